@@ -7,16 +7,14 @@
 
 # pyre-strict
 
-import itertools
-import math
 import os
-import random
 import unittest
 from typing import cast, List, Optional, Tuple
 
+import numpy as np
 import torch
 import torch.distributed as dist
-from hypothesis import given, settings, strategies as st, Verbosity
+from hypothesis import example, given, settings, strategies as st, Verbosity
 from torchrec.distributed.embedding_sharding import bucketize_kjt_before_all2all
 from torchrec.distributed.embeddingbag import EmbeddingBagCollectionSharder
 from torchrec.distributed.model_parallel import DistributedModelParallel
@@ -46,16 +44,19 @@ from torchrec.test_utils import get_free_port
 
 
 class UtilsTest(unittest.TestCase):
-    def test_get_unsharded_module_names(self) -> None:
+    @classmethod
+    def setUpClass(cls) -> None:
         os.environ["RANK"] = "0"
         os.environ["WORLD_SIZE"] = "1"
         os.environ["LOCAL_WORLD_SIZE"] = "1"
         os.environ["MASTER_ADDR"] = str("localhost")
         os.environ["MASTER_PORT"] = str(get_free_port())
-        device = torch.device("cpu")
-        backend = "gloo"
-        dist.init_process_group(backend=backend)
-        tables = [
+        # share the process group across tests, but leave one created by
+        # someone else alone
+        cls._owns_process_group: bool = not dist.is_initialized()
+        if cls._owns_process_group:
+            dist.init_process_group(backend="gloo")
+        cls._tables: List[EmbeddingBagConfig] = [
             EmbeddingBagConfig(
                 num_embeddings=10,
                 embedding_dim=4,
@@ -64,7 +65,7 @@ class UtilsTest(unittest.TestCase):
             )
             for i in range(2)
         ]
-        weighted_tables = [
+        cls._weighted_tables: List[EmbeddingBagConfig] = [
             EmbeddingBagConfig(
                 num_embeddings=10,
                 embedding_dim=4,
@@ -73,9 +74,17 @@ class UtilsTest(unittest.TestCase):
             )
             for i in range(2)
         ]
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        if cls._owns_process_group:
+            dist.destroy_process_group()
+
+    def test_get_unsharded_module_names(self) -> None:
+        device = torch.device("cpu")
         m = TestSparseNN(
-            tables=tables,
-            weighted_tables=weighted_tables,
+            tables=self._tables,
+            weighted_tables=self._weighted_tables,
             dense_device=device,
             sparse_device=device,
         )
@@ -92,87 +101,62 @@ class UtilsTest(unittest.TestCase):
             sorted(get_unsharded_module_names(dmp)),
             sorted(["_dmp_wrapped_module.over", "_dmp_wrapped_module.dense"]),
         )
-        dist.destroy_process_group()
+
+
+def _compute_row_placements(
+    row_indices: torch.Tensor,
+    lengths: torch.Tensor,
+    trainers_size: int,
+    block_sizes: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Returns, for every row that some trainer owns, its offset in the translated
+    lengths (i.e. trainer * lengths_size + feature * batch_size + batch iteration)
+    and its row index local to that trainer, along with the mask of such rows.
+    """
+    lengths_size = lengths.numel()
+    batch_size = lengths_size // block_sizes.numel()
+    # offset in lengths (i.e. feature * batch_size + batch iteration) of every row
+    lengths_offsets = torch.repeat_interleave(
+        torch.arange(lengths_size, device=lengths.device), lengths
+    )
+    row_block_sizes = block_sizes[lengths_offsets // batch_size]
+    # compute the owner of every row
+    trainer_offsets = torch.div(row_indices, row_block_sizes, rounding_mode="floor")
+    # we do not have enough trainers to handle these rows
+    keep = trainer_offsets < trainers_size
+    translated_lengths_offsets = (
+        trainer_offsets[keep] * lengths_size + lengths_offsets[keep]
+    )
+    local_row_indices = (row_indices % row_block_sizes)[keep]
+    return translated_lengths_offsets, local_row_indices, keep
 
 
 def _compute_translated_lengths(
-    row_indices: List[int],
-    indices_offsets: List[int],
+    translated_lengths_offsets: torch.Tensor,
     lengths_size: int,
     trainers_size: int,
-    block_sizes: List[int],
-) -> List[int]:
-    translated_lengths = [0] * trainers_size * lengths_size
-
-    batch_size = int(lengths_size / len(block_sizes))
-    iteration = feature_offset = batch_iteration = 0
-    for start_offset, end_offset in zip(indices_offsets, indices_offsets[1:]):
-        # iterate all rows that belong to current feature and batch iteration
-        for row_idx in row_indices[start_offset:end_offset]:
-            # compute the owner of this row
-            trainer_offset = int(row_idx / block_sizes[feature_offset])
-            # we do not have enough trainers to handle this row
-            if trainer_offset >= trainers_size:
-                continue
-            trainer_lengths_offset = trainer_offset * lengths_size
-            # compute the offset in lengths that is local in each trainer
-            local_lengths_offset = feature_offset * batch_size + batch_iteration
-            # increment the corresponding length in the trainer
-            translated_lengths[trainer_lengths_offset + local_lengths_offset] += 1
-        # bookkeeping
-        iteration += 1
-        feature_offset = int(iteration / batch_size)
-        batch_iteration = (batch_iteration + 1) % batch_size
-    return translated_lengths
+) -> torch.Tensor:
+    # count the rows that land in each trainer's copy of the lengths
+    return torch.bincount(
+        translated_lengths_offsets, minlength=trainers_size * lengths_size
+    )
 
 
 def _compute_translated_indices_with_weights(
-    translated_lengths: List[int],
-    row_indices: List[int],
-    indices_offsets: List[int],
-    lengths_size: int,
-    weights: Optional[List[int]],
-    trainers_size: int,
-    block_sizes: List[int],
-) -> List[Tuple[int, int]]:
-    translated_indices_with_weights = [(0, 0)] * len(row_indices)
-
-    translated_indices_offsets = list(itertools.accumulate([0] + translated_lengths))
-    batch_size = int(lengths_size / len(block_sizes))
-    iteration = feature_offset = batch_iteration = 0
-    for start_offset, end_offset in zip(indices_offsets, indices_offsets[1:]):
-        # iterate all rows that belong to current feature and batch iteration
-        # and assign the translated row index to the corresponding offset in output
-        for current_offset in range(start_offset, end_offset):
-            row_idx = row_indices[current_offset]
-            feature_block_size = block_sizes[feature_offset]
-            # compute the owner of this row
-            trainer_offset = int(row_idx / feature_block_size)
-            if trainer_offset >= trainers_size:
-                continue
-            trainer_lengths_offset = trainer_offset * lengths_size
-            # compute the offset in lengths that is local in each trainer
-            local_lengths_offset = feature_offset * batch_size + batch_iteration
-            # since we know the number of rows belonging to each trainer,
-            # we can figure out the corresponding offset in the translated indices list
-            # for the current translated index
-            translated_indices_offset = translated_indices_offsets[
-                trainer_lengths_offset + local_lengths_offset
-            ]
-            translated_indices_with_weights[translated_indices_offset] = (
-                row_idx % feature_block_size,
-                weights[current_offset] if weights else 0,
-            )
-            # the next row that goes to this trainer for this feature and batch
-            # combination goes to the next offset
-            translated_indices_offsets[
-                trainer_lengths_offset + local_lengths_offset
-            ] += 1
-        # bookkeeping
-        iteration += 1
-        feature_offset = int(iteration / batch_size)
-        batch_iteration = (batch_iteration + 1) % batch_size
-    return translated_indices_with_weights
+    translated_lengths_offsets: torch.Tensor,
+    local_row_indices: torch.Tensor,
+    keep: torch.Tensor,
+    weights: Optional[torch.Tensor],
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    # translated indices are laid out by trainer and then by feature and batch
+    # iteration; a stable sort on that key keeps the original order of the rows
+    # within each trainer, feature and batch iteration combination
+    perm = torch.argsort(translated_lengths_offsets, stable=True)
+    translated_indices = local_row_indices[perm]
+    if weights is None:
+        return translated_indices, None
+    return translated_indices, weights[keep][perm]
 
 
 def block_bucketize_ref(
@@ -181,104 +165,104 @@ def block_bucketize_ref(
     block_sizes: torch.Tensor,
     device: str = "cuda",
 ) -> KeyedJaggedTensor:
-    lengths_list = keyed_jagged_tensor.lengths().view(-1).tolist()
-    indices_list = keyed_jagged_tensor.values().view(-1).tolist()
-    weights_list = (
-        keyed_jagged_tensor.weights().view(-1).tolist()
-        if keyed_jagged_tensor.weights() is not None
-        else None
+    lengths = keyed_jagged_tensor.lengths().view(-1).long()
+    indices = keyed_jagged_tensor.values().view(-1).long()
+    weights = keyed_jagged_tensor.weights_or_none()
+    if weights is not None:
+        weights = weights.view(-1)
+    block_sizes = block_sizes.view(-1).long()
+
+    # the owner of every row is shared by the lengths and the indices
+    translated_lengths_offsets, local_row_indices, keep = _compute_row_placements(
+        row_indices=indices,
+        lengths=lengths,
+        trainers_size=trainers_size,
+        block_sizes=block_sizes,
     )
-    block_sizes_list = block_sizes.view(-1).tolist()
-    lengths_size = len(lengths_list)
-
-    """
-    each element in indices_offsets signifies both the starting offset, in indices_list,
-    that corresponds to all rows in a particular feature and batch iteration,
-    and the ending offset of the previous feature/batch iteration
-
-    For example:
-    given that features_size = 2 and batch_size = 2, an indices_offsets of
-    [0,1,4,6,6] signifies that:
-
-    elements in indices_list[0:1] belongs to feature 0 batch 0
-    elements in indices_list[1:4] belongs to feature 0 batch 1
-    elements in indices_list[4:6] belongs to feature 1 batch 0
-    elements in indices_list[6:6] belongs to feature 1 batch 1
-    """
-    indices_offsets = list(itertools.accumulate([0] + lengths_list))
-
     translated_lengths = _compute_translated_lengths(
-        row_indices=indices_list,
-        indices_offsets=indices_offsets,
-        lengths_size=lengths_size,
+        translated_lengths_offsets=translated_lengths_offsets,
+        lengths_size=lengths.numel(),
         trainers_size=trainers_size,
-        block_sizes=block_sizes_list,
     )
-    translated_indices_with_weights = _compute_translated_indices_with_weights(
-        translated_lengths=translated_lengths,
-        row_indices=indices_list,
-        indices_offsets=indices_offsets,
-        lengths_size=lengths_size,
-        weights=weights_list,
-        trainers_size=trainers_size,
-        block_sizes=block_sizes_list,
+    translated_indices, translated_weights = _compute_translated_indices_with_weights(
+        translated_lengths_offsets=translated_lengths_offsets,
+        local_row_indices=local_row_indices,
+        keep=keep,
+        weights=weights,
     )
 
-    translated_indices = [
-        translated_index for translated_index, _ in translated_indices_with_weights
-    ]
-
-    translated_weights = [
-        translated_weight for _, translated_weight in translated_indices_with_weights
-    ]
-
     expected_keys = [
         key for index in range(trainers_size) for key in keyed_jagged_tensor.keys()
     ]
-    if device == "cuda":
-        return KeyedJaggedTensor(
-            keys=expected_keys,
-            lengths=torch.tensor(
-                translated_lengths, dtype=keyed_jagged_tensor.lengths().dtype
-            )
-            .view(-1)
-            .cuda(),
-            values=torch.tensor(
-                translated_indices, dtype=keyed_jagged_tensor.values().dtype
-            ).cuda(),
-            weights=(
-                torch.tensor(translated_weights).float().cuda()
-                if weights_list
-                else None
-            ),
-        )
-    else:
-        return KeyedJaggedTensor(
-            keys=expected_keys,
-            lengths=torch.tensor(
-                translated_lengths, dtype=keyed_jagged_tensor.lengths().dtype
-            ).view(-1),
-            values=torch.tensor(
-                translated_indices, dtype=keyed_jagged_tensor.values().dtype
-            ),
-            weights=torch.tensor(translated_weights).float() if weights_list else None,
-        )
+    # the translated tensors already live on the input's device, so this is
+    # a no-op unless the reference is requested on a different device
+    return KeyedJaggedTensor(
+        keys=expected_keys,
+        lengths=translated_lengths.to(
+            device=device,
+            dtype=keyed_jagged_tensor.lengths().dtype,
+            non_blocking=True,
+        ),
+        values=translated_indices.to(
+            device=device,
+            dtype=keyed_jagged_tensor.values().dtype,
+            non_blocking=True,
+        ),
+        weights=(
+            translated_weights.to(device=device, dtype=torch.float, non_blocking=True)
+            if translated_weights is not None
+            else None
+        ),
+    )
 
 
 class KJTBucketizeTest(unittest.TestCase):
+    MAX_NUM_FEATURES = 15
+    MAX_BATCH_SIZE = 15
+    MAX_LENGTH = 10
+    # max number of rows needed for a given feature to have unique row index
+    MAX_ROW_COUNT: int = MAX_LENGTH * MAX_BATCH_SIZE
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        # invariant across hypothesis examples, build them once
+        cls._keys: List[str] = [f"feature_{i}" for i in range(cls.MAX_NUM_FEATURES)]
+
     # pyre-ignore[56]
     @given(
         index_type=st.sampled_from([torch.int, torch.long]),
         offset_type=st.sampled_from([torch.int, torch.long]),
-        world_size=st.integers(1, 129),
-        num_features=st.integers(1, 15),
-        batch_size=st.integers(1, 15),
+        world_size=st.sampled_from([1, 2, 8, 32, 129]),
+        num_features=st.sampled_from([1, 2, 7, MAX_NUM_FEATURES]),
+        batch_size=st.sampled_from([1, 2, 7, MAX_BATCH_SIZE]),
         variable_bucket_pos=st.booleans(),
         device=st.sampled_from(
             ["cpu"] + (["cuda"] if torch.cuda.device_count() > 0 else [])
         ),
+        seed=st.integers(0, 2**32 - 1),
+    )
+    # smallest and largest shapes are always covered
+    @example(
+        index_type=torch.int,
+        offset_type=torch.int,
+        world_size=1,
+        num_features=1,
+        batch_size=1,
+        variable_bucket_pos=False,
+        device="cpu",
+        seed=0,
     )
-    @settings(verbosity=Verbosity.verbose, max_examples=50, deadline=None)
+    @example(
+        index_type=torch.long,
+        offset_type=torch.long,
+        world_size=129,
+        num_features=MAX_NUM_FEATURES,
+        batch_size=MAX_BATCH_SIZE,
+        variable_bucket_pos=True,
+        device="cpu",
+        seed=0,
+    )
+    @settings(verbosity=Verbosity.verbose, max_examples=20, deadline=None)
     def test_kjt_bucketize_before_all2all(
         self,
         index_type: torch.dtype,
@@ -288,61 +272,56 @@ class KJTBucketizeTest(unittest.TestCase):
         batch_size: int,
         variable_bucket_pos: bool,
         device: str,
+        seed: int,
     ) -> None:
-        MAX_BATCH_SIZE = 15
-        MAX_LENGTH = 10
-        # max number of rows needed for a given feature to have unique row index
-        MAX_ROW_COUNT = MAX_LENGTH * MAX_BATCH_SIZE
-
-        lengths_list = [
-            random.randrange(MAX_LENGTH + 1) for _ in range(num_features * batch_size)
-        ]
-        keys_list = [f"feature_{i}" for i in range(num_features)]
+        rng = np.random.default_rng(seed)
+        lengths = rng.integers(0, self.MAX_LENGTH + 1, size=num_features * batch_size)
+        keys_list = self._keys[:num_features]
+        # number of indices needed is the length sum of all batches for a feature
+        feature_counts = lengths.reshape(num_features, batch_size).sum(axis=1)
         # for each feature, generate unrepeated row indices
         indices_lists = [
-            random.sample(
-                range(MAX_ROW_COUNT),
-                # number of indices needed is the length sum of all batches for a feature
-                sum(
-                    lengths_list[
-                        feature_offset * batch_size : (feature_offset + 1) * batch_size
-                    ]
-                ),
-            )
-            for feature_offset in range(num_features)
+            rng.choice(self.MAX_ROW_COUNT, size=feature_count, replace=False)
+            for feature_count in feature_counts
         ]
-        indices_list = list(itertools.chain(*indices_lists))
+        indices = np.concatenate(indices_lists)
 
-        weights_list = [random.randint(1, 100) for _ in range(len(indices_list))]
+        weights = rng.integers(1, 101, size=len(indices))
 
         # for each feature, calculate the minimum block size needed to
-        # distribute all rows to the available trainers
-        block_sizes_list = [
-            (
-                math.ceil((max(feature_indices_list) + 1) / world_size)
-                if feature_indices_list
-                else 1
+        # distribute all rows to the available trainers; the trailing 0 keeps
+        # the reduceat offsets of empty trailing features in bounds and never
+        # wins the max since row indices are non-negative
+        feature_max_indices = np.maximum.reduceat(
+            np.append(indices, 0), np.cumsum(feature_counts) - feature_counts
+        )
+        block_sizes_list = np.where(
+            feature_counts > 0, (feature_max_indices + world_size) // world_size, 1
+        ).tolist()
+        block_bucketize_row_pos = (
+            # row i holds the bucket boundaries [0, b, 2b, ..., world_size * b]
+            # of feature i with block size b
+            list(
+                (
+                    torch.tensor(block_sizes_list, dtype=index_type).unsqueeze(1)
+                    * torch.arange(world_size + 1, dtype=index_type).unsqueeze(0)
+                ).unbind(0)
             )
-            for feature_indices_list in indices_lists
-        ]
-        block_bucketize_row_pos = [] if variable_bucket_pos else None
-        if variable_bucket_pos:
-            for block_size in block_sizes_list:
-                # pyre-ignore
-                block_bucketize_row_pos.append(
-                    torch.tensor(
-                        [w * block_size for w in range(world_size + 1)],
-                        dtype=index_type,
-                    )
-                )
+            if variable_bucket_pos
+            else None
+        )
 
         kjt = KeyedJaggedTensor(
             keys=keys_list,
-            lengths=torch.tensor(lengths_list, dtype=offset_type, device=device).view(
-                num_features * batch_size
+            lengths=torch.from_numpy(lengths).to(
+                device=device, dtype=offset_type, non_blocking=True
+            ),
+            values=torch.from_numpy(indices).to(
+                device=device, dtype=index_type, non_blocking=True
+            ),
+            weights=torch.from_numpy(weights).to(
+                device=device, dtype=torch.float, non_blocking=True
             ),
-            values=torch.tensor(indices_list, dtype=index_type, device=device),
-            weights=torch.tensor(weights_list, dtype=torch.float, device=device),
         )
         """
         each entry in block_sizes identifies how many hashes for each feature goes
@@ -10,7 +10,16 @@
 #!/usr/bin/env python3
 
 import copy
-from typing import Any, cast, Dict, List, Optional, Tuple, Type, Union
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, cast, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 
 import click
 
@@ -22,6 +31,11 @@ from torch.optim import Optimizer
 from torchrec.distributed import DistributedModelParallel
 from torchrec.distributed.benchmark.benchmark_utils import benchmark_func
 from torchrec.distributed.embedding_types import EmbeddingComputeKernel
+from torchrec.distributed.fbgemm_qcomm_codec import (
+    CommType,
+    get_qcomm_codecs_registry,
+    QCommsConfig,
+)
 
 from torchrec.distributed.test_utils.multi_process import (
     MultiProcessContext,
@@ -42,9 +56,21 @@ from torchrec.distributed.train_pipeline.train_pipelines import (
     PrefetchTrainPipelineSparseDist,
     TrainPipelineSemiSync,
 )
-from torchrec.distributed.types import ModuleSharder, ShardingEnv, ShardingType
+from torchrec.distributed.types import (
+    EmbeddingModuleShardingPlan,
+    EnumerableShardingSpec,
+    ModuleSharder,
+    ParameterSharding,
+    ShardingEnv,
+    ShardingPlan,
+    ShardingType,
+    ShardMetadata,
+)
 from torchrec.modules.embedding_configs import EmbeddingBagConfig
+from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
 
+# args a --sweep config can override
+_SWEEP_KEYS: Set[str] = {"dim_emb", "batch_size", "pooling_factor"}
 
 _pipeline_cls: Dict[str, Type[Union[TrainPipelineBase, TrainPipelineSparseDist]]] = {
     "base": TrainPipelineBase,
@@ -53,6 +79,18 @@ _pipeline_cls: Dict[str, Type[Union[TrainPipelineBase, TrainPipelineSparseDist]]
     "prefetch": PrefetchTrainPipelineSparseDist,
 }
 
+_emb_optim_types: Dict[str, EmbOptimType] = {
+    "exact_adagrad": EmbOptimType.EXACT_ADAGRAD,
+    # one optimizer state scalar per row instead of one per element
+    "rowwise_adagrad": EmbOptimType.EXACT_ROWWISE_ADAGRAD,
+    "exact_sgd": EmbOptimType.EXACT_SGD,
+}
+
+_autocast_dtypes: Dict[str, torch.dtype] = {
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
 
 def _gen_pipelines(
     pipelines: str,
@@ -128,6 +166,89 @@ def _gen_pipelines(
     default="",
     help="profile output directory",
 )
+@click.option(
+    "--cache_device_inputs",
+    is_flag=True,
+    default=False,
+    help="Copy bench inputs to the device once up front instead of every iteration.",
+)
+@click.option(
+    "--prefetch_inputs",
+    is_flag=True,
+    default=False,
+    help="Copy the next bench input to the device on a side stream ahead of time.",
+)
+@click.option(
+    "--gen_workers",
+    type=int,
+    default=0,
+    help="Num of processes generating bench inputs on each rank, 0 to generate in-process.",
+)
+@click.option(
+    "--debug_anomaly",
+    is_flag=True,
+    default=False,
+    help="Enable autograd anomaly detection, this slows down every backward.",
+)
+@click.option(
+    "--pack_inputs",
+    is_flag=True,
+    default=False,
+    help="Store kjt bench inputs as one tensor per field and slice batches out of it.",
+)
+@click.option(
+    "--compile",
+    "compile_over_arch",
+    is_flag=True,
+    default=False,
+    help="torch.compile the dense over arch of the sharded model.",
+)
+@click.option(
+    "--precision",
+    type=click.Choice(["fp32", "bf16", "fp16"]),
+    default="fp32",
+    help="Autocast dtype of the forward pass, also used to quantize the sharded comms.",
+)
+@click.option(
+    "--qcomm_bwd_precision",
+    type=click.Choice(["fp32", "bf16", "fp16", "int8"]),
+    default=None,
+    help="Precision of the sharded comms in the backward pass, defaults to --precision.",
+)
+@click.option(
+    "--gen_on_device",
+    is_flag=True,
+    default=False,
+    help="Generate kjt bench inputs on the device. As with --cache_device_inputs, "
+    "every pipeline (TrainPipelineBase included) then runs with no-op H2D copies.",
+)
+@click.option(
+    "--sweep",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="JSON file with a list of configs, each overriding any of dim_emb, "
+    "batch_size and pooling_factor, to benchmark one after the other.",
+)
+@click.option(
+    "--cache_sharding_dir",
+    type=str,
+    default=None,
+    help="Directory to cache sharding plans in (as JSON), so repeated runs of the "
+    "same config skip the planner.",
+)
+@click.option(
+    "--share_inputs",
+    is_flag=True,
+    default=False,
+    help="Generate bench inputs once in the launching process and share them with "
+    "all ranks through shared memory, instead of generating them in every rank.",
+)
+@click.option(
+    "--emb_optim",
+    type=click.Choice(list(_emb_optim_types)),
+    default="exact_adagrad",
+    help="Optimizer fused into the embedding backward.",
+)
 def main(
     world_size: int,
     n_features: int,
@@ -140,6 +261,19 @@ def main(
     input_type: str,
     pipeline: str,
     profile: str,
+    cache_device_inputs: bool,
+    prefetch_inputs: bool,
+    gen_workers: int,
+    debug_anomaly: bool,
+    pack_inputs: bool,
+    compile_over_arch: bool,
+    precision: str,
+    qcomm_bwd_precision: Optional[str],
+    gen_on_device: bool,
+    sweep: Optional[str],
+    cache_sharding_dir: Optional[str],
+    share_inputs: bool,
+    emb_optim: str,
 ) -> None:
     """
     Checks that pipelined training is equivalent to non-pipelined training.
@@ -148,6 +282,80 @@ def main(
     num_weighted_features = int(n_features * ratio_features_weighted)
     num_features = n_features - num_weighted_features
 
+    sweep_configs = None
+    if sweep is not None:
+        with open(sweep) as f:
+            sweep_configs = json.load(f)
+        for cfg in sweep_configs:
+            unknown_keys = set(cfg) - _SWEEP_KEYS
+            if unknown_keys:
+                raise ValueError(
+                    f"Unknown keys {sorted(unknown_keys)} in sweep config {cfg}, "
+                    f"expected any of {sorted(_SWEEP_KEYS)}"
+                )
+
+    shared_inputs = None
+    if share_inputs:
+        if sweep_configs is not None:
+            raise click.UsageError("--share_inputs cannot be combined with --sweep")
+        tables, weighted_tables = _generate_tables(
+            num_features=num_features,
+            num_weighted_features=num_weighted_features,
+            dim_emb=dim_emb,
+        )
+        # pinned memory cannot be shared across processes
+        shared_inputs = [
+            _share_model_input(batch)
+            for batch in _generate_data(
+                tables=tables,
+                weighted_tables=weighted_tables,
+                num_float_features=10,
+                num_batches=num_batches,
+                batch_size=batch_size,
+                pooling_factor=pooling_factor,
+                input_type=input_type,
+                pin_memory=False,
+                num_workers=gen_workers,
+            )
+        ]
+
+    run_multi_process_func(
+        func=runner,
+        # the table configs are built in every rank, only their spec is pickled
+        num_features=num_features,
+        num_weighted_features=num_weighted_features,
+        dim_emb=dim_emb,
+        sharding_type=sharding_type.value,
+        kernel_type=EmbeddingComputeKernel.FUSED.value,
+        fused_params={},
+        batch_size=batch_size,
+        world_size=world_size,
+        num_batches=num_batches,
+        pooling_factor=pooling_factor,
+        input_type=input_type,
+        pipelines=pipeline,
+        profile=profile,
+        cache_device_inputs=cache_device_inputs,
+        prefetch_inputs=prefetch_inputs,
+        gen_workers=gen_workers,
+        debug_anomaly=debug_anomaly,
+        pack_inputs=pack_inputs,
+        compile_over_arch=compile_over_arch,
+        precision=precision,
+        qcomm_bwd_precision=qcomm_bwd_precision,
+        gen_on_device=gen_on_device,
+        sweep=sweep_configs,
+        cache_sharding_dir=cache_sharding_dir,
+        shared_inputs=shared_inputs,
+        emb_optim=emb_optim,
+    )
+
+
+def _generate_tables(
+    num_features: int,
+    num_weighted_features: int,
+    dim_emb: int,
+) -> Tuple[List[EmbeddingBagConfig], List[EmbeddingBagConfig]]:
     tables = [
         EmbeddingBagConfig(
             num_embeddings=max(i + 1, 100) * 1000,
@@ -166,24 +374,71 @@ def main(
         )
         for i in range(num_weighted_features)
     ]
+    return tables, weighted_tables
 
-    run_multi_process_func(
-        func=runner,
+
+def _generate_batch(
+    seed: Optional[int],
+    tables: List[EmbeddingBagConfig],
+    weighted_tables: List[EmbeddingBagConfig],
+    num_float_features: int,
+    batch_size: int,
+    pooling_factor: int,
+    input_type: str,
+    pin_memory: bool,
+) -> ModelInput:
+    if seed is not None:
+        torch.manual_seed(seed)
+    model_input_cls = ModelInput if input_type == "kjt" else TdModelInput
+    return model_input_cls.generate(
         tables=tables,
         weighted_tables=weighted_tables,
-        sharding_type=sharding_type.value,
-        kernel_type=EmbeddingComputeKernel.FUSED.value,
-        fused_params={},
         batch_size=batch_size,
-        world_size=world_size,
-        num_batches=num_batches,
-        pooling_factor=pooling_factor,
-        input_type=input_type,
-        pipelines=pipeline,
-        profile=profile,
+        num_float_features=num_float_features,
+        pooling_avg=pooling_factor,
+        pin_memory=pin_memory,
+    )
+
+
+def _pin_model_input(batch: ModelInput) -> ModelInput:
+    return ModelInput(
+        float_features=batch.float_features.pin_memory(),
+        idlist_features=(
+            batch.idlist_features.pin_memory()
+            if batch.idlist_features is not None
+            else None
+        ),
+        idscore_features=(
+            batch.idscore_features.pin_memory()
+            if batch.idscore_features is not None
+            else None
+        ),
+        label=batch.label.pin_memory(),
     )
 
 
+def _share_model_input(batch: ModelInput) -> ModelInput:
+    """
+    Moves the tensors of `batch` to shared memory in place, so spawned ranks
+    attach to them instead of receiving copies.
+    """
+    batch.float_features.share_memory_()
+    batch.label.share_memory_()
+    for features in (batch.idlist_features, batch.idscore_features):
+        if isinstance(features, KeyedJaggedTensor):
+            for t in (
+                features.values(),
+                features.lengths(),
+                features.weights_or_none(),
+            ):
+                if t is not None:
+                    t.share_memory_()
+        elif features is not None:
+            # td inputs carry a TensorDict, which shares all its leaves itself
+            features.share_memory_()
+    return batch
+
+
 def _generate_data(
     tables: List[EmbeddingBagConfig],
     weighted_tables: List[EmbeddingBagConfig],
@@ -192,29 +447,333 @@ def _generate_data(
     batch_size: int = 4096,
     pooling_factor: int = 10,
     input_type: str = "kjt",
+    pin_memory: bool = True,
+    num_workers: int = 0,
+    seed: int = 0,
 ) -> List[ModelInput]:
-    if input_type == "kjt":
+    """
+    Generates `num_batches` bench inputs, in a pool of `num_workers` processes
+    when `num_workers > 0`. Batch `i` is then generated from seed `seed + i` so
+    the data does not depend on how batches are scheduled onto the workers.
+    """
+    if num_workers <= 0:
         return [
-            ModelInput.generate(
-                tables=tables,
-                weighted_tables=weighted_tables,
-                batch_size=batch_size,
-                num_float_features=num_float_features,
-                pooling_avg=pooling_factor,
+            _generate_batch(
+                None,
+                tables,
+                weighted_tables,
+                num_float_features,
+                batch_size,
+                pooling_factor,
+                input_type,
+                pin_memory,
             )
             for _ in range(num_batches)
         ]
-    else:
-        return [
-            TdModelInput.generate(
-                tables=tables,
-                weighted_tables=weighted_tables,
-                batch_size=batch_size,
-                num_float_features=num_float_features,
-                pooling_avg=pooling_factor,
+
+    # spawn rather than fork, the calling process has CUDA and NCCL initialized;
+    # pinned memory does not survive the trip back, so pin in this process
+    with ProcessPoolExecutor(
+        max_workers=min(num_workers, num_batches),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        bench_inputs = list(
+            executor.map(
+                functools.partial(
+                    _generate_batch,
+                    tables=tables,
+                    weighted_tables=weighted_tables,
+                    num_float_features=num_float_features,
+                    batch_size=batch_size,
+                    pooling_factor=pooling_factor,
+                    input_type=input_type,
+                    pin_memory=False,
+                ),
+                range(seed, seed + num_batches),
             )
-            for _ in range(num_batches)
+        )
+    if pin_memory:
+        bench_inputs = [_pin_model_input(batch) for batch in bench_inputs]
+    return bench_inputs
+
+
+def _generate_kjts_on_device(
+    tables: List[EmbeddingBagConfig],
+    num_batches: int,
+    batch_size: int,
+    pooling_factor: int,
+    device: torch.device,
+) -> List[KeyedJaggedTensor]:
+    keys = [feature for table in tables for feature in table.feature_names]
+    num_embeddings = torch.tensor(
+        [
+            table.num_embeddings_post_pruning or table.num_embeddings
+            for table in tables
+            for _ in table.feature_names
+        ],
+        device=device,
+    )
+    # same lengths distribution as ModelInput.generate, for all batches at once
+    lengths = (
+        torch.normal(
+            pooling_factor,
+            pooling_factor / 10,
+            [num_batches, len(keys), batch_size],
+            device=device,
+        )
+        .clamp(min=1.0)
+        .long()
+    )
+    # values of all batches are drawn in one go, each bounded by the size of
+    # the table its feature looks up
+    bounds = torch.repeat_interleave(
+        num_embeddings.repeat(num_batches), lengths.sum(dim=-1).view(-1)
+    )
+    values = (torch.rand(bounds.shape, device=device) * bounds).long()
+    values_offsets = list(
+        itertools.accumulate(lengths.sum(dim=(1, 2)).tolist(), initial=0)
+    )
+    return [
+        KeyedJaggedTensor(
+            keys=keys,
+            values=values[values_offsets[i] : values_offsets[i + 1]],
+            lengths=lengths[i].view(-1),
+        )
+        for i in range(num_batches)
+    ]
+
+
+def _generate_data_on_device(
+    tables: List[EmbeddingBagConfig],
+    weighted_tables: List[EmbeddingBagConfig],
+    device: torch.device,
+    num_float_features: int = 10,
+    num_batches: int = 100,
+    batch_size: int = 4096,
+    pooling_factor: int = 10,
+) -> List[ModelInput]:
+    """
+    Generates `num_batches` kjt bench inputs directly on `device`, with a few
+    kernel launches for all batches rather than a few per feature per batch.
+    The inputs are views into shared tensors.
+    """
+    float_features = torch.rand(
+        (num_batches, batch_size, num_float_features), device=device
+    )
+    label = torch.rand((num_batches, batch_size), device=device)
+    idlist_features = (
+        _generate_kjts_on_device(
+            tables, num_batches, batch_size, pooling_factor, device
+        )
+        if tables
+        else None
+    )
+    idscore_features = (
+        _generate_kjts_on_device(
+            weighted_tables, num_batches, batch_size, pooling_factor, device
+        )
+        if weighted_tables
+        else None
+    )
+    return [
+        ModelInput(
+            float_features=float_features[i],
+            idlist_features=idlist_features[i] if idlist_features else None,
+            idscore_features=idscore_features[i] if idscore_features else None,
+            label=label[i],
+        )
+        for i in range(num_batches)
+    ]
+
+
+@dataclass
+class _PackedKJT:
+    keys: List[str]
+    values: torch.Tensor
+    lengths: torch.Tensor
+    weights: Optional[torch.Tensor]
+    # offsets of every batch in `values`, kept on host to slice without a sync
+    values_offsets: List[int]
+
+    def unpack(self, i: int) -> KeyedJaggedTensor:
+        num_lengths = self.lengths.numel() // (len(self.values_offsets) - 1)
+        start, end = self.values_offsets[i], self.values_offsets[i + 1]
+        return KeyedJaggedTensor(
+            keys=self.keys,
+            values=self.values[start:end],
+            lengths=self.lengths[i * num_lengths : (i + 1) * num_lengths],
+            weights=self.weights[start:end] if self.weights is not None else None,
+        )
+
+
+@dataclass
+class _PackedInputs:
+    """
+    Bench inputs laid out field by field: each tensor field of all batches is
+    concatenated into a single tensor, and `__iter__` yields batches as views
+    into those tensors.
+    """
+
+    num_batches: int
+    float_features: torch.Tensor
+    label: torch.Tensor
+    idlist_features: Optional[_PackedKJT]
+    idscore_features: Optional[_PackedKJT]
+
+    def __len__(self) -> int:
+        return self.num_batches
+
+    def __getitem__(self, i: int) -> ModelInput:
+        return ModelInput(
+            float_features=self.float_features[i],
+            idlist_features=(
+                self.idlist_features.unpack(i)
+                if self.idlist_features is not None
+                else None
+            ),
+            idscore_features=(
+                self.idscore_features.unpack(i)
+                if self.idscore_features is not None
+                else None
+            ),
+            label=self.label[i],
+        )
+
+    def __iter__(self) -> Iterator[ModelInput]:
+        return (self[i] for i in range(self.num_batches))
+
+
+def _pack_kjts(kjts: List[KeyedJaggedTensor], pin_memory: bool) -> _PackedKJT:
+    def _cat(tensors: List[torch.Tensor]) -> torch.Tensor:
+        packed = torch.cat(tensors)
+        return packed.pin_memory() if pin_memory else packed
+
+    weights = [kjt.weights_or_none() for kjt in kjts]
+    return _PackedKJT(
+        keys=kjts[0].keys(),
+        values=_cat([kjt.values() for kjt in kjts]),
+        lengths=_cat([kjt.lengths() for kjt in kjts]),
+        weights=(
+            _cat(cast(List[torch.Tensor], weights))
+            if all(w is not None for w in weights)
+            else None
+        ),
+        values_offsets=list(
+            itertools.accumulate((kjt.values().numel() for kjt in kjts), initial=0)
+        ),
+    )
+
+
+def _pack_inputs(bench_inputs: List[ModelInput]) -> _PackedInputs:
+    """
+    Packs a list of KJT bench inputs into one tensor per field, pinned if the
+    inputs were. All batches are expected to have the same batch size and keys.
+    """
+    first = bench_inputs[0]
+    pin_memory = first.float_features.is_pinned()
+
+    def _stack(tensors: List[torch.Tensor]) -> torch.Tensor:
+        packed = torch.stack(tensors)
+        return packed.pin_memory() if pin_memory else packed
+
+    return _PackedInputs(
+        num_batches=len(bench_inputs),
+        float_features=_stack([batch.float_features for batch in bench_inputs]),
+        label=_stack([batch.label for batch in bench_inputs]),
+        idlist_features=(
+            _pack_kjts(
+                [
+                    cast(KeyedJaggedTensor, batch.idlist_features)
+                    for batch in bench_inputs
+                ],
+                pin_memory,
+            )
+            if first.idlist_features is not None
+            else None
+        ),
+        idscore_features=(
+            _pack_kjts(
+                [
+                    cast(KeyedJaggedTensor, batch.idscore_features)
+                    for batch in bench_inputs
+                ],
+                pin_memory,
+            )
+            if first.idscore_features is not None
+            else None
+        ),
+    )
+
+
+class _PrefetchIter(Iterator[ModelInput]):
+    """
+    Wraps an iterator of host batches and copies the next batch to `device` on a
+    side stream while the current one is being consumed. Inputs should be pinned
+    for the copies to actually overlap with compute.
+    """
+
+    def __init__(self, it: Iterator[ModelInput], device: torch.device) -> None:
+        self._it = it
+        self._device = device
+        self._stream: torch.cuda.Stream = torch.cuda.Stream(device)
+        self._next: Optional[ModelInput] = None
+        self._prefetch()
+
+    def _prefetch(self) -> None:
+        batch = next(self._it, None)
+        if batch is None:
+            self._next = None
+            return
+        with torch.cuda.stream(self._stream):
+            self._next = batch.to(device=self._device, non_blocking=True)
+
+    def __iter__(self) -> "_PrefetchIter":
+        return self
+
+    def __next__(self) -> ModelInput:
+        batch = self._next
+        if batch is None:
+            raise StopIteration
+        # pipelines may pull batches from their own memcpy stream, so sync with
+        # whichever stream is current at the time
+        current_stream = torch.cuda.current_stream(self._device)
+        current_stream.wait_stream(self._stream)
+        batch.record_stream(current_stream)
+        self._prefetch()
+        return batch
+
+
+def _make_dataloader(
+    bench_inputs: List[ModelInput],
+    device: torch.device,
+    prefetch_inputs: bool = False,
+) -> Iterator[ModelInput]:
+    if prefetch_inputs and device.type == "cuda":
+        return _PrefetchIter(iter(bench_inputs), device)
+    return iter(bench_inputs)
+
+
+def _copy_inputs_to_device(
+    bench_inputs: List[ModelInput],
+    device: torch.device,
+) -> List[ModelInput]:
+    """
+    Copies the (pinned) bench inputs to `device` once, on a side stream, so the
+    benchmarked pipelines iterate over batches that are already device-resident.
+    """
+    if device.type != "cuda":
+        return bench_inputs
+    current_stream = torch.cuda.current_stream(device)
+    copy_stream = torch.cuda.Stream(device)
+    copy_stream.wait_stream(current_stream)
+    with torch.cuda.stream(copy_stream):
+        device_inputs = [
+            batch.to(device=device, non_blocking=True) for batch in bench_inputs
         ]
+    current_stream.wait_stream(copy_stream)
+    for batch in device_inputs:
+        batch.record_stream(current_stream)
+    return device_inputs
 
 
 def _generate_sharded_model_and_optimizer(
@@ -224,17 +783,43 @@ def _generate_sharded_model_and_optimizer(
     pg: dist.ProcessGroup,
     device: torch.device,
     fused_params: Optional[Dict[str, Any]] = None,
+    own_model: bool = False,
+    precision: str = "fp32",
+    qcomm_bwd_precision: Optional[str] = None,
+    plan: Optional[ShardingPlan] = None,
 ) -> Tuple[nn.Module, Optimizer]:
+    """
+    Shards `model` with DMP. Unless `own_model` is set, DMP is handed a deep copy
+    so `model` stays usable by the caller; set it when `model` is thrown away
+    afterwards to skip copying the dense params.
+
+    With a reduced `precision` the sharded comms are quantized to it and the
+    forward of the sharded model runs under autocast. `qcomm_bwd_precision`
+    overrides the precision of the backward comms only, e.g. int8 gradients.
+    """
+    qcomm_codecs_registry = None
+    if qcomm_bwd_precision is None:
+        qcomm_bwd_precision = precision
+    if precision != "fp32" or qcomm_bwd_precision != "fp32":
+        qcomm_codecs_registry = get_qcomm_codecs_registry(
+            qcomms_config=QCommsConfig(
+                forward_precision=CommType(precision),
+                backward_precision=CommType(qcomm_bwd_precision),
+            ),
+            device=device,
+        )
     sharder = TestEBCSharder(
         sharding_type=sharding_type,
         kernel_type=kernel_type,
         fused_params=fused_params,
+        qcomm_codecs_registry=qcomm_codecs_registry,
     )
     sharded_model = DistributedModelParallel(
-        module=copy.deepcopy(model),
+        module=model if own_model else copy.deepcopy(model),
         env=ShardingEnv.from_process_group(pg),
         init_data_parallel=True,
         device=device,
+        plan=plan,
         sharders=[
             cast(
                 ModuleSharder[nn.Module],
@@ -249,13 +834,154 @@ def _generate_sharded_model_and_optimizer(
             if "sparse" not in name
         ],
         lr=0.1,
+        # a single fused kernel per param group on GPU, multi-tensor ops elsewhere
+        **({"fused": True} if device.type == "cuda" else {"foreach": True}),
     )
+    if precision in _autocast_dtypes:
+        _autocast_forward(sharded_model, device, _autocast_dtypes[precision])
     return sharded_model, optimizer
 
 
+def _sharding_plan_path(
+    cache_sharding_dir: str,
+    plan_inputs: Dict[str, Any],
+) -> str:
+    """
+    Path of the cached plan for `plan_inputs`, which must hold every (JSON
+    serializable) input the sharding depends on. The plan is the same on all ranks,
+    so a single file is shared by them.
+    """
+    key = hashlib.sha256(
+        json.dumps(plan_inputs, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(cache_sharding_dir, f"plan_{key[:32]}.json")
+
+
+def _sharding_plan_to_json(plan: ShardingPlan) -> Optional[Dict[str, Any]]:
+    """
+    Serializes the plan of the bench model, or returns None when it uses anything
+    beyond sharding/compute kernel types and shard placements.
+    """
+    modules = {}
+    for module_path, module_plan in plan.plan.items():
+        if not isinstance(module_plan, EmbeddingModuleShardingPlan):
+            return None
+        params = {}
+        for param_name, ps in module_plan.items():
+            if any(
+                value is not None
+                for value in (
+                    ps.cache_params,
+                    ps.enforce_hbm,
+                    ps.stochastic_rounding,
+                    ps.bounds_check_mode,
+                    ps.output_dtype,
+                    ps.key_value_params,
+                )
+            ):
+                return None
+            shards = None
+            if ps.sharding_spec is not None:
+                if not isinstance(ps.sharding_spec, EnumerableShardingSpec):
+                    return None
+                shards = [
+                    {
+                        "shard_offsets": shard.shard_offsets,
+                        "shard_sizes": shard.shard_sizes,
+                        "placement": str(shard.placement),
+                    }
+                    for shard in ps.sharding_spec.shards
+                ]
+            params[param_name] = {
+                "sharding_type": ps.sharding_type,
+                "compute_kernel": ps.compute_kernel,
+                "ranks": ps.ranks,
+                "shards": shards,
+            }
+        modules[module_path] = params
+    return modules
+
+
+def _sharding_plan_from_json(modules: Dict[str, Any]) -> ShardingPlan:
+    return ShardingPlan(
+        plan={
+            module_path: EmbeddingModuleShardingPlan(
+                {
+                    param_name: ParameterSharding(
+                        sharding_type=ps["sharding_type"],
+                        compute_kernel=ps["compute_kernel"],
+                        ranks=ps["ranks"],
+                        sharding_spec=(
+                            EnumerableShardingSpec(
+                                [ShardMetadata(**shard) for shard in ps["shards"]]
+                            )
+                            if ps["shards"] is not None
+                            else None
+                        ),
+                    )
+                    for param_name, ps in params.items()
+                }
+            )
+            for module_path, params in modules.items()
+        }
+    )
+
+
+def _load_sharding_plan(
+    path: str, rank: int, pg: dist.ProcessGroup, device: torch.device
+) -> Optional[ShardingPlan]:
+    """
+    Rank 0 reads the cached plan and broadcasts it, so all ranks agree on whether
+    to skip the (collective) planner. A missing or unreadable file is a cache miss.
+    """
+    modules = [None]
+    if rank == 0:
+        try:
+            with open(path) as f:
+                modules[0] = json.load(f)
+        except (OSError, ValueError):
+            pass
+    dist.broadcast_object_list(modules, src=0, group=pg, device=device)
+    return _sharding_plan_from_json(modules[0]) if modules[0] is not None else None
+
+
+def _save_sharding_plan(path: str, plan: ShardingPlan) -> None:
+    modules = _sharding_plan_to_json(plan)
+    if modules is None:
+        return
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # written next to the target and renamed into place, so readers never see a
+    # partial file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(modules, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _autocast_forward(
+    model: nn.Module, device: torch.device, dtype: torch.dtype
+) -> None:
+    forward = model.forward
+
+    # pyre-ignore [2, 3]
+    def _forward(*args, **kwargs) -> Any:
+        with torch.autocast(device_type=device.type, dtype=dtype):
+            return forward(*args, **kwargs)
+
+    # pipelines call the model directly, patch the instance so they pick it up
+    # pyre-ignore [8]
+    model.forward = _forward
+
+
 def runner(
-    tables: List[EmbeddingBagConfig],
-    weighted_tables: List[EmbeddingBagConfig],
+    num_features: int,
+    num_weighted_features: int,
+    dim_emb: int,
     rank: int,
     sharding_type: str,
     kernel_type: str,
@@ -267,9 +993,23 @@ def runner(
     input_type: str,
     pipelines: str,
     profile: str,
+    cache_device_inputs: bool = False,
+    prefetch_inputs: bool = False,
+    gen_workers: int = 0,
+    debug_anomaly: bool = False,
+    pack_inputs: bool = False,
+    compile_over_arch: bool = False,
+    precision: str = "fp32",
+    qcomm_bwd_precision: Optional[str] = None,
+    gen_on_device: bool = False,
+    sweep: Optional[List[Dict[str, int]]] = None,
+    cache_sharding_dir: Optional[str] = None,
+    shared_inputs: Optional[List[ModelInput]] = None,
+    emb_optim: str = "exact_adagrad",
 ) -> None:
 
-    torch.autograd.set_detect_anomaly(True)
+    if debug_anomaly:
+        torch.autograd.set_detect_anomaly(True)
     with MultiProcessContext(
         rank=rank,
         world_size=world_size,
@@ -277,78 +1017,167 @@ def runner(
         use_deterministic_algorithms=False,
     ) as ctx:
 
-        unsharded_model = TestSparseNN(
-            tables=tables,
-            weighted_tables=weighted_tables,
-            dense_device=ctx.device,
-            sparse_device=torch.device("meta"),
-            over_arch_clazz=TestOverArchLarge,
-        )
+        # a sweep runs every config in the same processes, so the process group
+        # and the CUDA context are only set up once
+        for cfg in sweep or [{}]:
+            tables, weighted_tables = _generate_tables(
+                num_features=num_features,
+                num_weighted_features=num_weighted_features,
+                dim_emb=cfg.get("dim_emb", dim_emb),
+            )
+            cfg_batch_size = cfg.get("batch_size", batch_size)
+            cfg_pooling_factor = cfg.get("pooling_factor", pooling_factor)
+            if sweep and rank == 0:
+                print(f"sweep config: {cfg}")
 
-        sharded_model, optimizer = _generate_sharded_model_and_optimizer(
-            model=unsharded_model,
-            sharding_type=sharding_type,
-            kernel_type=kernel_type,
-            # pyre-ignore
-            pg=ctx.pg,
-            device=ctx.device,
-            fused_params={
-                "optimizer": EmbOptimType.EXACT_ADAGRAD,
+            unsharded_model = TestSparseNN(
+                tables=tables,
+                weighted_tables=weighted_tables,
+                dense_device=ctx.device,
+                sparse_device=torch.device("meta"),
+                over_arch_clazz=TestOverArchLarge,
+            )
+
+            fused_params = {
+                "optimizer": _emb_optim_types[emb_optim],
                 "learning_rate": 0.1,
-            },
-        )
-        bench_inputs = _generate_data(
-            tables=tables,
-            weighted_tables=weighted_tables,
-            num_float_features=10,
-            num_batches=num_batches,
-            batch_size=batch_size,
-            pooling_factor=pooling_factor,
-            input_type=input_type,
-        )
-        for pipeline_clazz in _gen_pipelines(pipelines=pipelines):
-            if pipeline_clazz == TrainPipelineSemiSync:
-                # pyre-ignore [28]
-                pipeline = pipeline_clazz(
-                    model=sharded_model,
-                    optimizer=optimizer,
+            }
+            plan_path, plan = None, None
+            if cache_sharding_dir is not None:
+                plan_path = _sharding_plan_path(
+                    cache_sharding_dir,
+                    {
+                        "sharding_type": sharding_type,
+                        "kernel_type": kernel_type,
+                        "world_size": world_size,
+                        "tables": [
+                            [t.name, t.num_embeddings, t.embedding_dim, t.feature_names]
+                            for t in tables
+                        ],
+                        "weighted_tables": [
+                            [t.name, t.num_embeddings, t.embedding_dim, t.feature_names]
+                            for t in weighted_tables
+                        ],
+                        "batch_size": cfg_batch_size,
+                        "pooling_factor": cfg_pooling_factor,
+                        "emb_optim": emb_optim,
+                        "learning_rate": fused_params["learning_rate"],
+                        "precision": precision,
+                        "qcomm_bwd_precision": qcomm_bwd_precision,
+                    },
+                )
+                # pyre-ignore
+                plan = _load_sharding_plan(plan_path, rank, ctx.pg, ctx.device)
+            sharded_model, optimizer = _generate_sharded_model_and_optimizer(
+                model=unsharded_model,
+                sharding_type=sharding_type,
+                kernel_type=kernel_type,
+                # pyre-ignore
+                pg=ctx.pg,
+                device=ctx.device,
+                fused_params=fused_params,
+                own_model=True,
+                precision=precision,
+                qcomm_bwd_precision=qcomm_bwd_precision,
+                plan=plan,
+            )
+            del unsharded_model
+            if plan_path is not None and plan is None and rank == 0:
+                # pyre-ignore [16]
+                _save_sharding_plan(plan_path, sharded_model.plan)
+            if compile_over_arch:
+                # shapes are fixed for the whole run, so the over arch can be
+                # specialized and captured into CUDA graphs; the compiled module
+                # shares its params, which are already registered with DDP
+                # pyre-ignore [16]
+                sharded_model.module.over = torch.compile(
+                    # pyre-ignore [16]
+                    sharded_model.module.over,
+                    mode="reduce-overhead",
+                    fullgraph=False,
+                    dynamic=False,
+                )
+            if shared_inputs is not None:
+                bench_inputs = shared_inputs
+            elif gen_on_device and input_type == "kjt":
+                bench_inputs = _generate_data_on_device(
+                    tables=tables,
+                    weighted_tables=weighted_tables,
                     device=ctx.device,
-                    start_batch=0,
+                    num_float_features=10,
+                    num_batches=num_batches,
+                    batch_size=cfg_batch_size,
+                    pooling_factor=cfg_pooling_factor,
                 )
             else:
-                pipeline = pipeline_clazz(
-                    model=sharded_model,
-                    optimizer=optimizer,
-                    device=ctx.device,
+                bench_inputs = _generate_data(
+                    tables=tables,
+                    weighted_tables=weighted_tables,
+                    num_float_features=10,
+                    num_batches=num_batches,
+                    batch_size=cfg_batch_size,
+                    pooling_factor=cfg_pooling_factor,
+                    input_type=input_type,
+                    num_workers=gen_workers,
+                    seed=rank * num_batches,
+                )
+            if cache_device_inputs:
+                bench_inputs = _copy_inputs_to_device(bench_inputs, ctx.device)
+            if pack_inputs and input_type == "kjt":
+                # pyre-ignore [9]
+                bench_inputs = _pack_inputs(bench_inputs)
+            for pipeline_clazz in _gen_pipelines(pipelines=pipelines):
+                if pipeline_clazz == TrainPipelineSemiSync:
+                    # pyre-ignore [28]
+                    pipeline = pipeline_clazz(
+                        model=sharded_model,
+                        optimizer=optimizer,
+                        device=ctx.device,
+                        start_batch=0,
+                    )
+                else:
+                    pipeline = pipeline_clazz(
+                        model=sharded_model,
+                        optimizer=optimizer,
+                        device=ctx.device,
+                    )
+                # a single step is enough to fill the pipeline and run its lazy
+                # init, it only pulls the few batches the pipeline holds
+                pipeline.progress(
+                    _make_dataloader(bench_inputs, ctx.device, prefetch_inputs)
                 )
-            pipeline.progress(iter(bench_inputs))
-
-            def _func_to_benchmark(
-                bench_inputs: List[ModelInput],
-                model: nn.Module,
-                pipeline: TrainPipeline,
-            ) -> None:
-                dataloader = iter(bench_inputs)
-                while True:
-                    try:
+
+                def _func_to_benchmark(
+                    bench_inputs: List[ModelInput],
+                    model: nn.Module,
+                    pipeline: TrainPipeline,
+                ) -> None:
+                    dataloader = _make_dataloader(
+                        bench_inputs, ctx.device, prefetch_inputs
+                    )
+                    # the pipeline takes one batch from the dataloader per step,
+                    # batches it still holds from the previous run are trained
+                    # on first, so the pipeline is never drained between runs
+                    for _ in range(len(bench_inputs)):
                         pipeline.progress(dataloader)
-                    except StopIteration:
-                        break
-
-            result = benchmark_func(
-                name=pipeline_clazz.__name__,
-                bench_inputs=bench_inputs,  # pyre-ignore
-                prof_inputs=bench_inputs,  # pyre-ignore
-                num_benchmarks=5,
-                num_profiles=2,
-                profile_dir=profile,
-                world_size=world_size,
-                func_to_benchmark=_func_to_benchmark,
-                benchmark_func_kwargs={"model": sharded_model, "pipeline": pipeline},
-                rank=rank,
-            )
-            if rank == 0:
-                print(result)
+
+                result = benchmark_func(
+                    name=pipeline_clazz.__name__,
+                    bench_inputs=bench_inputs,  # pyre-ignore
+                    prof_inputs=bench_inputs,  # pyre-ignore
+                    num_benchmarks=5,
+                    num_profiles=2,
+                    profile_dir=profile,
+                    world_size=world_size,
+                    func_to_benchmark=_func_to_benchmark,
+                    benchmark_func_kwargs={
+                        "model": sharded_model,
+                        "pipeline": pipeline,
+                    },
+                    rank=rank,
+                )
+                if rank == 0:
+                    print(result)
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@
 # pyre-strict
 
 import copy
+import itertools
 
 import unittest
 from contextlib import contextmanager, ExitStack
@@ -2043,6 +2044,58 @@ class DataLoadingThreadTest(unittest.TestCase):
             data_loader.get_next_batch(True)
         data_loader.stop()
 
+    def test_fetch_data_buffered(self) -> None:
+        data = [torch.tensor([i]) for i in range(7)]
+        data_loader = DataLoadingThread(
+            torch.device("cpu"), iter(data), True, buffer_size=3
+        )
+        data_loader.start()
+        for i in range(7):
+            item = data_loader.get_next_batch()
+            self.assertEqual(item.item(), i)
+
+        self.assertIsNone(data_loader.get_next_batch(False))
+        # the end of stream is sticky
+        self.assertIsNone(data_loader.get_next_batch(False))
+        with self.assertRaises(StopIteration):
+            data_loader.get_next_batch(True)
+        data_loader.join(timeout=10)
+        self.assertFalse(data_loader.is_alive())
+
+    def test_stop_with_full_buffer(self) -> None:
+        data_iter = (torch.tensor([i]) for i in itertools.count())
+        data_loader = DataLoadingThread(
+            torch.device("cpu"), data_iter, True, buffer_size=2
+        )
+        data_loader.start()
+        self.assertEqual(data_loader.get_next_batch().item(), 0)
+        # the thread blocks once 2 batches are buffered, stop() must release it
+        data_loader.stop()
+        data_loader.join(timeout=10)
+        self.assertFalse(data_loader.is_alive())
+
+    # pyre-fixme[56]: Pyre was not able to infer the type of argument
+    @unittest.skipIf(
+        not torch.cuda.is_available(),
+        "Not enough GPUs, this test requires at least one GPU",
+    )
+    def test_pin_memory(self) -> None:
+        device = torch.device("cuda:0")
+        data = [
+            torch.tensor([0]),
+            torch.tensor([1]).pin_memory(),
+            torch.tensor([2], device=device),
+        ]
+        data_loader = DataLoadingThread(device, iter(data), True, pin_memory=True)
+        data_loader.start()
+        for i in range(3):
+            item = data_loader.get_next_batch()
+            self.assertEqual(item.device, device)
+            self.assertEqual(item.item(), i)
+
+        self.assertIsNone(data_loader.get_next_batch(False))
+        data_loader.stop()
+
 
 class EvalPipelineSparseDistTest(unittest.TestCase):
     def test_processing(self) -> None:
@@ -10,6 +10,7 @@
 import copy
 import enum
 import unittest
+from collections import OrderedDict
 from typing import List
 from unittest.mock import MagicMock
 
@@ -31,6 +32,7 @@ from torchrec.distributed.train_pipeline.utils import (
     NodeArgsHelper,
     PipelinedForward,
     PipelinedPostproc,
+    recursive_record_stream,
 )
 from torchrec.distributed.types import ShardingType
 from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
@@ -346,3 +348,70 @@ class TestUtils(unittest.TestCase):
 
         # Weights is call_module node, so we should only find 2 args unmodified
         self.assertEqual(num_found, len(kjt_args) - 1)
+
+    def test_handle_placeholder(self) -> None:
+        graph = torch.fx.Graph()
+        node_args_helper = NodeArgsHelper(MagicMock(), TrainPipelineContext(), False)
+        attr, item = ArgInfoStepFactory.get_attr, ArgInfoStepFactory.get_item
+        for ph_key, expected_steps in [
+            ("a[0].b", [attr("a"), item(0), attr("b")]),
+            ("a[-1]", [attr("a"), item(-1)]),
+            ("a[k]", [attr("a"), item("k")]),
+            # items are used verbatim, quotes included
+            ('a["k"]', [attr("a"), item('"k"')]),
+            ("a['0'][1]", [attr("a"), item("'0'"), item(1)]),
+        ]:
+            node = torch.fx.Node(graph, "ph", "placeholder", "ph", (), {})
+            # pyre-ignore[16]
+            node.ph_key = ph_key
+            arg_info = node_args_helper._handle_placeholder(node, ArgInfo(steps=[]))
+            self.assertEqual(arg_info.steps, expected_steps, ph_key)
+
+    def test_process_steps(self) -> None:
+        batch = ModelInput(
+            float_features=torch.rand(2, 3),
+            idlist_features=KeyedJaggedTensor.from_lengths_sync(
+                keys=["f1"],
+                values=torch.tensor([1, 2, 3]),
+                lengths=torch.tensor([1, 2]),
+            ),
+            idscore_features=None,
+            label=torch.rand(2),
+        )
+        arg_info = ArgInfo(
+            steps=[
+                ArgInfoStepFactory.noop(),
+                ArgInfoStepFactory.get_attr("idlist_features"),
+                ArgInfoStepFactory.get_attr("_keys"),
+                ArgInfoStepFactory.get_item(0),
+            ]
+        )
+        self.assertEqual(arg_info.process_steps(batch), "f1")
+
+        # adding a step rebuilds the fused steps
+        arg_info.append_step(ArgInfoStepFactory.from_scalar(3))
+        self.assertEqual(arg_info.process_steps(batch), 3)
+
+        # copies do not share the fused steps of the original
+        arg_info_copy = copy.deepcopy(arg_info)
+        self.assertEqual(arg_info_copy, arg_info)
+        self.assertIsNone(arg_info_copy._compiled)
+        self.assertEqual(arg_info_copy.process_steps(batch), 3)
+
+        self.assertIsNone(ArgInfo(steps=[]).process_steps(batch))
+        self.assertIs(
+            ArgInfo(steps=[ArgInfoStepFactory.noop()]).process_steps(batch), batch
+        )
+
+    def test_recursive_record_stream(self) -> None:
+        kjts = [MagicMock(spec=KeyedJaggedTensor) for _ in range(4)]
+        stream = MagicMock()
+        res = (
+            kjts[0],
+            [kjts[1], {"a": kjts[2]}],
+            # subclasses of the containers are walked too
+            OrderedDict(b=[kjts[3], torch.ones(1)]),
+        )
+        recursive_record_stream(res, stream)
+        for kjt in kjts:
+            kjt.record_stream.assert_called_once_with(stream)
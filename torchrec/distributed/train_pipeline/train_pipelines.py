@@ -30,7 +30,6 @@ from typing import (
 )
 
 import torch
-from torch.autograd.profiler import record_function
 from torchrec.distributed.dist_data import KJTAllToAllTensorsAwaitable
 from torchrec.distributed.model_parallel import ShardedModule
 from torchrec.distributed.train_pipeline.pipeline_context import (
@@ -41,6 +40,7 @@ from torchrec.distributed.train_pipeline.pipeline_context import (
     TrainPipelineContext,
 )
 from torchrec.distributed.train_pipeline.utils import (
+    _maybe_record_function,
     _override_input_dist_forwards,
     _pipeline_detach_model,
     _prefetch_embeddings,
@@ -130,7 +130,7 @@ class TrainPipeline(abc.ABC, Generic[In, Out]):
             index is not None
         ), f"{self.__class__.__name__} context does not provide number of batches: {context=}"
         if index % interval_batches == 0:
-            with record_function("## dmp_collection_sync ##"):
+            with _maybe_record_function("## dmp_collection_sync ##"):
                 model.sync()
 
 
@@ -203,7 +203,7 @@ class TrainPipelineBase(TrainPipeline[In, Out]):
         self._connected = True
 
     def _next_batch(self, dataloader_iter: Iterator[In]) -> Optional[In]:
-        with record_function("## next_batch ##"):
+        with _maybe_record_function("## next_batch ##"):
             try:
                 next_batch = next(dataloader_iter)
             except StopIteration:
@@ -213,15 +213,15 @@ class TrainPipelineBase(TrainPipeline[In, Out]):
         return next_batch
 
     def _wait_for_batch(self, cur_batch: In) -> None:
-        with record_function("## wait_for_batch ##"):
+        with _maybe_record_function("## wait_for_batch ##"):
             _wait_for_batch(cur_batch, self._memcpy_stream)
 
     def _backward(self, losses: torch.Tensor) -> None:
-        with record_function("## backward ##"):
+        with _maybe_record_function("## backward ##"):
             torch.sum(losses, dim=0).backward()
 
     def _copy_batch_to_gpu(self, cur_batch: In) -> None:
-        with record_function("## copy_batch_to_gpu ##"):
+        with _maybe_record_function("## copy_batch_to_gpu ##"):
             with self._stream_context(self._memcpy_stream):
                 self._cur_batch = _to_device(cur_batch, self._device, non_blocking=True)
 
@@ -240,7 +240,7 @@ class TrainPipelineBase(TrainPipeline[In, Out]):
         # cur_batch could be None
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
         if cur_batch is not None:
@@ -248,7 +248,7 @@ class TrainPipelineBase(TrainPipeline[In, Out]):
 
         # model will need to handle if cur_batch is empty; this is needed if there's
         # communicative ops
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             (losses, output) = self._model(cur_batch)
 
         if self._model.training:
@@ -261,7 +261,7 @@ class TrainPipelineBase(TrainPipeline[In, Out]):
 
         # Update
         if self._model.training:
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         return output
@@ -315,10 +315,10 @@ class TrainPipelinePT2(TrainPipelineBase[In, Out]):
 
         cc = self._compile_configs
 
-        with record_function("## load_batch ##"):
+        with _maybe_record_function("## load_batch ##"):
             cur_batch = next(dataloader_iter)
 
-        with record_function("## copy_batch_to_gpu ##"):
+        with _maybe_record_function("## copy_batch_to_gpu ##"):
             self._cur_batch = _to_device(cur_batch, self._device, non_blocking=False)
 
         # Input transformer here is used also for pt2 hints to compiler, that should happen on exact object passed to model.compile.
@@ -327,10 +327,10 @@ class TrainPipelinePT2(TrainPipelineBase[In, Out]):
             self._cur_batch = self._input_transformer(self._cur_batch)
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             if self._iter == cc.compile_on_iter:
                 logger.info("Compiling model...")
                 if self._pre_compile_fn:
@@ -357,10 +357,10 @@ class TrainPipelinePT2(TrainPipelineBase[In, Out]):
             self._iter += 1
 
         if self._model.training:
-            with record_function("## backward ##"):
+            with _maybe_record_function("## backward ##"):
                 torch.sum(losses).backward()
 
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         return output
@@ -615,11 +615,11 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
             return
 
     def _wait_for_batch(self) -> None:
-        with record_function("## wait_for_batch ##"):
+        with _maybe_record_function("## wait_for_batch ##"):
             _wait_for_batch(cast(In, self.batches[0]), self._data_dist_stream)
 
     def _backward(self, losses: torch.Tensor) -> None:
-        with record_function("## backward ##"):
+        with _maybe_record_function("## backward ##"):
             torch.sum(losses, dim=0).backward()
 
     def progress(self, dataloader_iter: Iterator[In]) -> Out:
@@ -646,7 +646,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
         self._set_module_context(self.contexts[0])
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
         # wait for batches[0] being available on device, this should always be completed since
@@ -662,7 +662,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
             self.enqueue_batch(dataloader_iter)
 
         # forward
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             losses, output = self._model_fwd(self.batches[0])
 
         if self._enqueue_batch_after_forward:
@@ -686,7 +686,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
             )
 
             # update
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         self.dequeue_batch()
@@ -755,7 +755,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
                 `self._execute_all_batches=True`, then returns None.
         """
         context = self._create_context()
-        with record_function(f"## copy_batch_to_gpu {context.index} ##"):
+        with _maybe_record_function("## copy_batch_to_gpu %s ##", context.index):
             with self._stream_context(self._memcpy_stream):
                 batch = self._next_batch(dataloader_iter)
                 if batch is not None:
@@ -776,7 +776,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
         if self._dataloader_exhausted:
             batch = None
         else:
-            with record_function("## next_batch ##"):
+            with _maybe_record_function("## next_batch ##"):
                 batch = next(dataloader_iter, None)
             if batch is None:
                 self._dataloader_exhausted = True
@@ -790,7 +790,7 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
         """
         if batch is None:
             return
-        with record_function(f"## start_sparse_data_dist {context.index} ##"):
+        with _maybe_record_function("## start_sparse_data_dist %s ##", context.index):
             with self._stream_context(self._data_dist_stream):
                 _wait_for_batch(batch, self._memcpy_stream)
 
@@ -803,11 +803,12 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
         Waits on the input dist splits requests to get the input dist tensors requests,
         and populates the context with them.
         """
-        with record_function(f"## wait_sparse_data_dist {context.index} ##"):
+        with _maybe_record_function("## wait_sparse_data_dist %s ##", context.index):
             with self._stream_context(self._data_dist_stream):
                 for names, awaitable in context.fused_splits_awaitables:
-                    for name, request in zip(names, awaitable.wait()):
-                        context.input_dist_tensors_requests[name] = request
+                    context.input_dist_tensors_requests.update(
+                        zip(names, awaitable.wait())
+                    )
         context.input_dist_splits_requests.clear()
         context.fused_splits_awaitables.clear()
 
@@ -834,15 +835,16 @@ class TrainPipelineSparseDist(TrainPipeline[In, Out]):
         and populates the context with them.
         """
         self._set_module_context(self._context)
-        with record_function("## wait_sparse_data_dist ##"):
+        with _maybe_record_function("## wait_sparse_data_dist ##"):
             with self._stream_context(self._data_dist_stream):
                 self._context.module_contexts = (
                     self._context.module_contexts_next_batch.copy()
                 )
                 self._context.input_dist_tensors_requests.clear()
                 for names, awaitable in self._context.fused_splits_awaitables:
-                    for name, request in zip(names, awaitable.wait()):
-                        self._context.input_dist_tensors_requests[name] = request
+                    self._context.input_dist_tensors_requests.update(
+                        zip(names, awaitable.wait())
+                    )
 
     def _fill_pipeline(self, dataloader_iter: Iterator[In]) -> None:
         """
@@ -970,7 +972,7 @@ class TrainPipelineFusedSparseDist(TrainPipelineSparseDist[In, Out]):
         if batch is None:
             return
 
-        with record_function(f"## start_embedding_lookup {context.index} ##"):
+        with _maybe_record_function("## start_embedding_lookup %s ##", context.index):
             current_stream = torch.get_device_module(self._device).current_stream()
             with self._stream_context(self._emb_lookup_stream):
                 for module in self._pipelined_modules:
@@ -1010,7 +1012,7 @@ class TrainPipelineFusedSparseDist(TrainPipelineSparseDist[In, Out]):
         self.start_embedding_lookup(self.batches[0], self.contexts[0])
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
         # wait for batches[0] being available on device, this should always be completed since
@@ -1025,7 +1027,7 @@ class TrainPipelineFusedSparseDist(TrainPipelineSparseDist[In, Out]):
         self.enqueue_batch(dataloader_iter)
 
         # forward
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             losses, output = self._model_fwd(self.batches[0])
 
         if len(self.batches) >= 2:
@@ -1037,7 +1039,7 @@ class TrainPipelineFusedSparseDist(TrainPipelineSparseDist[In, Out]):
             self._backward(losses)
 
             # update
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         self.dequeue_batch()
@@ -1213,9 +1215,9 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
             self.wait_sparse_data_dist(self.contexts[1])
 
         if self._model.training:
-            with record_function(f"## backward {iteration} ##"):
+            with _maybe_record_function("## backward %s ##", iteration):
                 torch.sum(losses, dim=0).backward()
-            with record_function(f"## emb_backward {iteration} ##"):
+            with _maybe_record_function("## emb_backward %s ##", iteration):
                 # pyre-ignore [6]
                 self.embedding_backward(context)
 
@@ -1226,12 +1228,12 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
             )
             del context  # context is no longer needed, deleting to free up memory
 
-            with record_function(f"## optimizer {iteration - 1} ##"):
+            with _maybe_record_function("## optimizer %s ##", iteration - 1):
                 if is_semi_sync and self._stash_gradients:
                     self._grad_swap()
                 self._mlp_optimizer_step(iteration)
 
-            with record_function(f"## zero_grad {iteration - 1} ##"):
+            with _maybe_record_function("## zero_grad %s ##", iteration - 1):
                 self._optimizer.zero_grad()
         else:
             del context
@@ -1246,7 +1248,7 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
     def _mlp_forward(
         self, batch: In, context: TrainPipelineContext
     ) -> Tuple[torch.Tensor, Out]:
-        with record_function(f"## forward {context.index} ##"):
+        with _maybe_record_function("## forward %s ##", context.index):
             _wait_for_events(
                 batch, context, torch.get_device_module(self._device).current_stream()
             )
@@ -1291,7 +1293,7 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
         dataloader_iter: Iterator[In],
     ) -> Tuple[Optional[In], Optional[TrainPipelineContext]]:
         context = None
-        with record_function(f"## copy_batch_to_gpu {self._next_index} ##"):
+        with _maybe_record_function("## copy_batch_to_gpu %s ##", self._next_index):
             with self._stream_context(self._memcpy_stream):
                 batch = self._next_batch(dataloader_iter)
                 if batch is not None:
@@ -1318,7 +1320,9 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
 
         # Temporarily set context for next iter to populate cache
         with use_context_for_postprocs(self._pipelined_postprocs, context):
-            with record_function(f"## start_sparse_data_dist {context.index} ##"):
+            with _maybe_record_function(
+                "## start_sparse_data_dist %s ##", context.index
+            ):
                 with self._stream_context(self._data_dist_stream):
                     _wait_for_events(batch, context, self._data_dist_stream)
                     model_input = self.extract_model_input_from_batch(batch)
@@ -1338,7 +1342,7 @@ class TrainPipelineSemiSync(TrainPipelineSparseDist[In, Out]):
         if batch is None:
             return
 
-        with record_function(f"## start_embedding_lookup {context.index} ##"):
+        with _maybe_record_function("## start_embedding_lookup %s ##", context.index):
             current_stream = torch.get_device_module(self._device).current_stream()
             _wait_for_events(batch, context, current_stream)
             for i, module in enumerate(self._pipelined_modules):
@@ -1451,28 +1455,28 @@ class PrefetchTrainPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
         self._fill_pipeline(dataloader_iter)
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
-        with record_function("## wait_for_batch ##"):
+        with _maybe_record_function("## wait_for_batch ##"):
             _wait_for_batch(cast(In, self._batch_i), self._prefetch_stream)
 
         self._batch_ip2 = self._copy_batch_to_gpu(dataloader_iter)
 
         self._wait_sparse_data_dist()
         # forward
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             losses, output = self._model_fwd(self._batch_i)
 
         self._prefetch(self._batch_ip1)
 
         if self._model.training:
             # backward
-            with record_function("## backward ##"):
+            with _maybe_record_function("## backward ##"):
                 torch.sum(losses, dim=0).backward()
 
             # update
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         self._start_sparse_data_dist(self._batch_ip2)
@@ -1491,7 +1495,7 @@ class PrefetchTrainPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
         self._context.module_input_post_prefetch.clear()
         self._context.module_contexts_post_prefetch.clear()
 
-        with record_function("## sharded_module_prefetch ##"):
+        with _maybe_record_function("## sharded_module_prefetch ##"):
             with self._stream_context(self._prefetch_stream):
                 batch.record_stream(
                     torch.get_device_module(self._device).current_stream()
@@ -1505,13 +1509,15 @@ class PrefetchTrainPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
                     self._data_dist_stream,
                     self._default_stream,
                 )
-                for sharded_module in self._pipelined_modules:
-                    forward = sharded_module.forward
-                    data = data_per_pipelined_module[forward._name]
-                    self._context.module_input_post_prefetch[forward._name] = data
-                    self._context.module_contexts_post_prefetch[forward._name] = (
-                        self._context.module_contexts.pop(forward._name)
-                    )
+                # module contexts are only created for pipelined modules, so all of
+                # them move over
+                self._context.module_input_post_prefetch.update(
+                    data_per_pipelined_module
+                )
+                self._context.module_contexts_post_prefetch.update(
+                    self._context.module_contexts
+                )
+                self._context.module_contexts.clear()
 
 
 class EvalPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
@@ -1537,6 +1543,10 @@ class EvalPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
         device (torch.device): device where device transfer, sparse data dist, and
             forward/backward pass will happen.
         apply_jit (bool): apply torch.jit.script to non-pipelined (unsharded) modules.
+        pin_memory (bool): pin batches in the background thread before the device
+            transfer, so it runs asynchronously. Batches must be on CPU.
+        buffer_size (int): number of batches the background thread loads and
+            transfers ahead of the pipeline.
     """
 
     # The PipelinedForward class that is used in _rewrite_model
@@ -1548,9 +1558,13 @@ class EvalPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
         optimizer: torch.optim.Optimizer,
         device: torch.device,
         apply_jit: bool = False,
+        pin_memory: bool = False,
+        buffer_size: int = 1,
     ) -> None:
         super().__init__(model, optimizer, device, True, apply_jit)
         self._batch_loader: Optional[DataLoadingThread[In]] = None
+        self._pin_memory = pin_memory
+        self._buffer_size = buffer_size
 
     def __del__(self) -> None:
         if self._batch_loader is not None:
@@ -1564,6 +1578,8 @@ class EvalPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
                 to_device_non_blocking=True,
                 memcpy_stream_priority=-1,
                 memcpy_stream=self._memcpy_stream,
+                buffer_size=self._buffer_size,
+                pin_memory=self._pin_memory,
             )
             self._batch_loader.start()
 
@@ -1592,14 +1608,14 @@ class EvalPipelineSparseDist(TrainPipelineSparseDist[In, Out]):
         if len(self.batches) == 0:
             raise StopIteration
 
-        with record_function("## wait_for_batch ##"):
+        with _maybe_record_function("## wait_for_batch ##"):
             _wait_for_batch(cast(In, self.batches[0]), self._data_dist_stream)
 
         if len(self.batches) >= 2:
             self.start_sparse_data_dist(self.batches[1], self.contexts[1])
 
         # forward
-        with record_function("## forward ##"):
+        with _maybe_record_function("## forward ##"):
             losses, output = cast(
                 Tuple[torch.Tensor, Out], self._model(self.batches[0])
             )
@@ -1735,7 +1751,7 @@ class StagedTrainPipeline(TrainPipeline[In, Optional[StageOut]]):
         if self._dataloader_exhausted or self._flushing:
             batch = None
         else:
-            with record_function("## next_batch ##"):
+            with _maybe_record_function("## next_batch ##"):
                 batch = next(dataloader_iter, None)
             if batch is None:
                 self._dataloader_exhausted = True
@@ -1760,8 +1776,11 @@ class StagedTrainPipeline(TrainPipeline[In, Optional[StageOut]]):
                 f"Running ## Pipeline Stage {stage_idx} : {stage.name} for batch {batch_offset + self._num_steps} ##",
             )
 
-        with record_function(
-            f"## Pipeline Stage {stage_idx} : {stage.name} for batch {batch_offset + self._num_steps} ##"
+        with _maybe_record_function(
+            "## Pipeline Stage %s : %s for batch %s ##",
+            stage_idx,
+            stage.name,
+            batch_offset + self._num_steps,
         ):
             if stage_idx == 0:
                 batch_to_wait = self._next_batch(dataloader_iter)
@@ -2005,10 +2024,10 @@ class TrainPipelineSparseDistCompAutograd(TrainPipelineSparseDist[In, Out]):
         self._set_module_context(self.contexts[0])
 
         if self._model.training:
-            with record_function("## zero_grad ##"):
+            with _maybe_record_function("## zero_grad ##"):
                 self._optimizer.zero_grad()
 
-        with record_function("## wait_for_batch ##"):
+        with _maybe_record_function("## wait_for_batch ##"):
             _wait_for_batch(cast(In, self.batches[0]), self._data_dist_stream)
 
         if len(self.batches) >= 2:
@@ -2019,7 +2038,9 @@ class TrainPipelineSparseDistCompAutograd(TrainPipelineSparseDist[In, Out]):
 
         # forward
         ctx = self.get_compiled_autograd_ctx()
-        with ctx, torchrec_use_sync_collectives(), record_function("## forward ##"):
+        with ctx, torchrec_use_sync_collectives(), _maybe_record_function(
+            "## forward ##"
+        ):
             losses, output = self._model_fwd(self.batches[0])
 
         if len(self.batches) >= 2:
@@ -2028,13 +2049,13 @@ class TrainPipelineSparseDistCompAutograd(TrainPipelineSparseDist[In, Out]):
         if self._model.training:
             # backward
             ctx = self.get_compiled_autograd_ctx()
-            with ctx, torchrec_use_sync_collectives(), record_function(
+            with ctx, torchrec_use_sync_collectives(), _maybe_record_function(
                 "## backward ##"
             ):
                 torch.sum(losses, dim=0).backward()
 
             # update
-            with record_function("## optimizer ##"):
+            with _maybe_record_function("## optimizer ##"):
                 self._optimizer.step()
 
         self.dequeue_batch()
@@ -12,18 +12,23 @@ import contextlib
 import copy
 import itertools
 import logging
+import operator
+import os
+import re
 from collections import defaultdict, deque, OrderedDict
 from contextlib import AbstractContextManager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from itertools import chain
-from threading import Event, Thread
+from queue import SimpleQueue
+from threading import Thread
 from typing import (
     Any,
     Callable,
     cast,
     Deque,
     Dict,
+    FrozenSet,
     Generator,
     Generic,
     Iterable,
@@ -39,6 +44,7 @@ from typing import (
 
 import torch
 from torch import distributed as dist
+from torch.utils._pytree import tree_unflatten
 from torch.utils.hooks import RemovableHandle
 
 if not torch._running_with_deploy():
@@ -75,7 +81,12 @@ from torchrec.distributed.train_pipeline.pipeline_context import (
 
 from torchrec.distributed.types import Awaitable, LazyNoWait
 
-from torchrec.sparse.jagged_tensor import JaggedTensor, KeyedJaggedTensor, KeyedTensor
+from torchrec.sparse.jagged_tensor import (
+    _pin_and_move,
+    JaggedTensor,
+    KeyedJaggedTensor,
+    KeyedTensor,
+)
 from torchrec.streamable import Multistreamable, Pipelineable
 
 logger: logging.Logger = logging.getLogger(__name__)
@@ -84,6 +95,14 @@ StageOut = TypeVar("StageOut", bound=Pipelineable)
 RunnableType = Callable[..., StageOut]
 StageOutputWithEvent = Tuple[Optional[StageOut], Optional[torch.Event]]
 
+# device types with streams the pipelines run on
+_STREAM_DEVICE_TYPES: FrozenSet[str] = frozenset(("cuda", "mtia"))
+
+# set TORCHREC_PIPELINE_RECORD_FUNCTION=0 to skip the per batch profiler scopes
+_EMIT_RECORD_FUNCTION: bool = (
+    os.environ.get("TORCHREC_PIPELINE_RECORD_FUNCTION", "1") != "0"
+)
+
 
 @dataclass
 class PipelineStage:
@@ -129,10 +148,7 @@ class BaseArgInfoStep(abc.ABC):
         """
         if not isinstance(other, type(self)):
             return False
-        return all(
-            getattr(self, field_name) == getattr(other, field_name)
-            for field_name in self.__dict__.keys()
-        )
+        return self.__dict__ == other.__dict__
 
 
 class NoopArgInfoStep(BaseArgInfoStep):
@@ -244,6 +260,74 @@ class ArgInfoStepFactory:
         return DictArgInfoStep(value)
 
 
+# pyre-ignore[2]
+def _compile_element(value) -> Callable[[Any], Any]:
+    if isinstance(value, ArgInfo):
+        return value.process_steps
+    return lambda _arg: value
+
+
+def _compile_list_step(step: ListArgInfoStep) -> Callable[[Any], Any]:
+    fns = tuple(_compile_element(v) for v in step.value)
+    return lambda arg: [fn(arg) for fn in fns]
+
+
+def _compile_dict_step(step: DictArgInfoStep) -> Callable[[Any], Any]:
+    keys = tuple(step.value.keys())
+    fns = tuple(_compile_element(v) for v in step.value.values())
+    return lambda arg: dict(zip(keys, [fn(arg) for fn in fns]))
+
+
+def _compile_steps(steps: List[BaseArgInfoStep]) -> Callable[[Any], Any]:
+    """
+    Fuses a sequence of steps into a single callable: noops are dropped, runs of
+    attribute lookups become one `operator.attrgetter` and item lookups become
+    `operator.itemgetter`, so the common chains run without per-step dispatch.
+    List and dict steps sort their elements into constants and nested `ArgInfo`s
+    once, instead of on every call.
+    """
+    fns: List[Callable[[Any], Any]] = []
+    attr_names: List[str] = []
+
+    def _flush_attrs() -> None:
+        if attr_names:
+            fns.append(operator.attrgetter(".".join(attr_names)))
+            attr_names.clear()
+
+    for step in steps:
+        if isinstance(step, NoopArgInfoStep):
+            continue
+        if isinstance(step, GetAttrArgInfoStep):
+            attr_names.append(step.attr_name)
+            continue
+        _flush_attrs()
+        if isinstance(step, GetItemArgInfoStep):
+            fns.append(operator.itemgetter(step.item_index))
+        elif isinstance(step, ScalarArgInfoStep):
+            # a scalar ignores its input, so the steps before it never matter
+            fns = [lambda _arg, value=step.value: value]
+        elif isinstance(step, ListArgInfoStep):
+            fns.append(_compile_list_step(step))
+        elif isinstance(step, DictArgInfoStep):
+            fns.append(_compile_dict_step(step))
+        else:
+            fns.append(step.process)
+    _flush_attrs()
+
+    if not fns:
+        return lambda arg: arg
+    if len(fns) == 1:
+        return fns[0]
+
+    # pyre-ignore
+    def _process(arg) -> Any:
+        for fn in fns:
+            arg = fn(arg)
+        return arg
+
+    return _process
+
+
 @dataclass
 class ArgInfo:
     """
@@ -255,16 +339,25 @@ class ArgInfo:
             output of previous step used as an input for the next. I.e. for 3 steps
             it is similar to step3(step2(step1(input)))
             See `BaseArgInfoStep` class hierearchy for supported transformations
+
+    The steps are fused into a single callable on the first `process_steps` call.
+    Use `add_step`/`append_step` rather than mutating `steps` directly, so the fused
+    callable is rebuilt.
     """
 
     steps: List[BaseArgInfoStep]
+    _compiled: Optional[Callable[[Any], Any]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def add_step(self, step: BaseArgInfoStep) -> "ArgInfo":
         self.steps.insert(0, step)
+        self._compiled = None
         return self
 
     def append_step(self, step: BaseArgInfoStep) -> "ArgInfo":
         self.steps.append(step)
+        self._compiled = None
         return self
 
     # pyre-ignore[3]
@@ -274,43 +367,132 @@ class ArgInfo:
     ) -> Any:
         if not self.steps:
             return None
-        for step in self.steps:
-            arg = step.process(arg)
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = _compile_steps(self.steps)
+        return compiled(arg)
 
-        return arg
+    def __getstate__(self) -> Dict[str, Any]:
+        # the fused callable closes over the steps, copies rebuild their own
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
 
 
 @dataclass
 class CallArgs:
+    """
+    Args and kwargs of a call, as `ArgInfo`s to build them from the input batch.
+
+    `build_args_kwargs` flattens them into tuples of callables and kwarg names on
+    first use. `args` and `kwargs` are not expected to change after that.
+    """
+
     args: List[ArgInfo]
     kwargs: Dict[str, ArgInfo]
+    _flat: Optional[
+        Tuple[
+            Tuple[Callable[[Any], Any], ...],
+            Tuple[str, ...],
+            Tuple[Callable[[Any], Any], ...],
+        ]
+    ] = field(default=None, init=False, repr=False, compare=False)
 
     # pyre-ignore[3]
     def build_args_kwargs(
         self, initial_input: Any  # pyre-ignore[2]
     ) -> Tuple[List[Any], Dict[str, Any]]:
-        args = [arg.process_steps(initial_input) for arg in self.args]
-        kwargs = {
-            key: arg.process_steps(initial_input) for key, arg in self.kwargs.items()
-        }
+        flat = self._flat
+        if flat is None:
+            flat = self._flat = (
+                tuple(arg.process_steps for arg in self.args),
+                tuple(self.kwargs.keys()),
+                tuple(arg.process_steps for arg in self.kwargs.values()),
+            )
+        arg_fns, kwarg_keys, kwarg_fns = flat
+        args = [fn(initial_input) for fn in arg_fns]
+        kwargs = dict(zip(kwarg_keys, [fn(initial_input) for fn in kwarg_fns]))
         return args, kwargs
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # the flattened callables are bound to the ArgInfos, copies rebuild their own
+        state = self.__dict__.copy()
+        state["_flat"] = None
+        return state
+
+
+def _record_stream_tensor(
+    res: torch.Tensor,
+    _stack,  # pyre-ignore[2]
+    tensors: List[torch.Tensor],
+) -> None:
+    if res.device.type in _STREAM_DEVICE_TYPES:
+        tensors.append(res)
+
+
+# pyre-ignore[2]
+def _record_stream_iterable(res, stack, _tensors: List[torch.Tensor]) -> None:
+    stack.extend(res)
+
+
+# pyre-ignore[2]
+def _record_stream_dict(res, stack, _tensors: List[torch.Tensor]) -> None:
+    stack.extend(res.values())
+
+
+# exact type lookups for the common cases, subclasses go through isinstance below
+# pyre-ignore[4]
+_RECORD_STREAM_HANDLERS: Dict[type, Callable[..., None]] = {
+    torch.Tensor: _record_stream_tensor,
+    list: _record_stream_iterable,
+    tuple: _record_stream_iterable,
+    dict: _record_stream_dict,
+}
+
 
 def recursive_record_stream(
     # pyre-fixme[2]: Parameter `re` must have a type that does not contain `Any`
     res: Union[torch.Tensor, Pipelineable, Iterable[Any], Dict[Any, Any]],
     stream: torch.Stream,
 ) -> None:
-    if isinstance(res, torch.Tensor) and res.device.type in ["cuda", "mtia"]:
-        res.record_stream(stream)
-    elif isinstance(res, Pipelineable):
-        res.record_stream(stream)
-    elif isinstance(res, (list, tuple)):
-        for v in res:
-            recursive_record_stream(v, stream)
-    elif isinstance(res, dict):
-        for v in res.values():
-            recursive_record_stream(v, stream)
+    # pyre-ignore[9]
+    stack: List[Any] = [res]
+    tensors: List[torch.Tensor] = []
+    while stack:
+        res = stack.pop()
+        handler = _RECORD_STREAM_HANDLERS.get(type(res))
+        if handler is not None:
+            handler(res, stack, tensors)
+        elif isinstance(res, torch.Tensor):
+            _record_stream_tensor(res, stack, tensors)
+        elif isinstance(res, Pipelineable):
+            res.record_stream(stream)
+        elif isinstance(res, (list, tuple)):
+            stack.extend(res)
+        elif isinstance(res, dict):
+            stack.extend(res.values())
+
+    if len(tensors) == 1:
+        tensors[0].record_stream(stream)
+        return
+    # outputs often hold several views of one buffer, record each storage once
+    seen: Set[int] = set()
+    for tensor in tensors:
+        storage_ptr = tensor.untyped_storage().data_ptr()
+        if storage_ptr not in seen:
+            seen.add(storage_ptr)
+            tensor.record_stream(stream)
+
+
+def _maybe_record_function(name: str, *args: object) -> AbstractContextManager[object]:
+    """
+    `record_function(name % args)` scope for the per batch pipeline steps, unless
+    disabled with `TORCHREC_PIPELINE_RECORD_FUNCTION=0`. The label is only
+    formatted when the scope is recorded.
+    """
+    if not _EMIT_RECORD_FUNCTION:
+        return contextlib.nullcontext()
+    return record_function(name % args if args else name)
 
 
 class NoOpStream:
@@ -382,12 +564,17 @@ class PipelinedPostproc(torch.nn.Module):
             # pyre-ignore
             self._stream_context = (
                 torch.get_device_module(device).stream
-                if device.type in ["cuda", "mtia"]
+                if device.type in _STREAM_DEVICE_TYPES
                 else torch.cuda.stream
             )
         else:
             self._stream_context = NoOpStream
 
+        # type of the last result and whether record_stream applies to it, outputs
+        # usually keep their type so the isinstance check runs once
+        self._res_type: Optional[type] = None
+        self._res_records_stream: bool = False
+
     @property
     def postproc_module(self) -> torch.nn.Module:
         return self._postproc_module
@@ -430,7 +617,7 @@ class PipelinedPostproc(torch.nn.Module):
         # Use input[0] as _start_data_dist only passes 1 arg
         args, kwargs = self._args.build_args_kwargs(input[0])
 
-        with record_function(f"## sdd_input_postproc {self._context.index} ##"):
+        with _maybe_record_function("## sdd_input_postproc %s ##", self._context.index):
             # should be no-op as we call this in dist stream
             with self._stream_context(self._dist_stream):
                 res = self._postproc_module(*args, **kwargs)
@@ -439,7 +626,12 @@ class PipelinedPostproc(torch.nn.Module):
             if self._default_stream and self._dist_stream:
                 self._default_stream.wait_stream(self._dist_stream)
 
-                if isinstance(res, (torch.Tensor, Pipelineable, Iterable, Dict)):
+                if type(res) is not self._res_type:
+                    self._res_type = type(res)
+                    self._res_records_stream = isinstance(
+                        res, (torch.Tensor, Pipelineable, Iterable, Dict)
+                    )
+                if self._res_records_stream:
                     # Result from module forward might be a complex type such as
                     # Tuple[KeyedJaggedTensor, Dict[str, torch.Tensor]]
                     # In this case, we need to first iterate over each element of tuple
@@ -551,6 +743,11 @@ class BaseForward(Generic[TForwardContext]):
         self._context = context
         self._stream = stream
         self._device: torch.device = stream.device if stream else torch.device("cuda")
+        # resolved once, forwards look up the streams of this module on every batch
+        self._device_module: Any = torch.get_device_module(self._device)
+        # process group of the input dist splits, fixed once the model is rewritten
+        self._splits_pg_resolved: bool = False
+        self._splits_pg: Optional[dist.ProcessGroup] = None
 
     @property
     def name(self) -> str:
@@ -566,6 +763,16 @@ class BaseForward(Generic[TForwardContext]):
     def get_context(self) -> TForwardContext:
         return self._context
 
+    def splits_pg(self, request: Awaitable[Any]) -> Optional[dist.ProcessGroup]:
+        """
+        Process group of the module's input dist splits `request`, worked out from
+        the first request only.
+        """
+        if not self._splits_pg_resolved:
+            self._splits_pg = _get_splits_pg(request)
+            self._splits_pg_resolved = True
+        return self._splits_pg
+
 
 class PipelinedForward(BaseForward[TrainPipelineContext]):
     """
@@ -574,15 +781,14 @@ class PipelinedForward(BaseForward[TrainPipelineContext]):
 
     # pyre-ignore [2, 24]
     def __call__(self, *input, **kwargs) -> Awaitable:
-        assert (
-            self._name in self._context.input_dist_tensors_requests
+        request = self._context.input_dist_tensors_requests.pop(self._name, None)
+        assert isinstance(
+            request, Awaitable
         ), "Invalid PipelinedForward usage, please do not directly call model.forward()"
-        request = self._context.input_dist_tensors_requests.pop(self._name)
-        assert isinstance(request, Awaitable)
-        with record_function("## wait_sparse_data_dist ##"):
+        with _maybe_record_function("## wait_sparse_data_dist ##"):
             # Finish waiting on the dist_stream,
             # in case some delayed stream scheduling happens during the wait() call.
-            with torch.get_device_module(self._device).stream(self._stream):
+            with self._device_module.stream(self._stream):
                 data = request.wait()
 
         # Make sure that both result of input_dist and context
@@ -590,10 +796,8 @@ class PipelinedForward(BaseForward[TrainPipelineContext]):
         ctx = self._context.module_contexts.pop(self._name)
 
         if self._stream is not None:
-            torch.get_device_module(self._device).current_stream().wait_stream(
-                self._stream
-            )
-            cur_stream = torch.get_device_module(self._device).current_stream()
+            cur_stream = self._device_module.current_stream()
+            cur_stream.wait_stream(self._stream)
 
             assert isinstance(
                 data, (torch.Tensor, Multistreamable)
@@ -621,20 +825,18 @@ class EmbeddingPipelinedForward(BaseForward[EmbeddingTrainPipelineContext]):
             Awaitable[EmbeddingModuleRetType], Awaitable[Optional[KeyedJaggedTensor]]
         ],
     ]:
+        awaitable = self._context.embedding_a2a_requests.pop(self._name, None)
         assert (
-            self._name in self._context.embedding_a2a_requests
+            awaitable is not None
         ), "Invalid EmbeddingPipelinedForward usage, please do not directly call model.forward()"
 
         ctx = self._context.module_contexts.pop(self._name)
-        cur_stream = torch.get_device_module(self._device).current_stream()
+        cur_stream = self._device_module.current_stream()
 
         if self._stream is not None:
-            torch.get_device_module(self._device).current_stream().wait_stream(
-                self._stream
-            )
+            cur_stream.wait_stream(self._stream)
             ctx.record_stream(cur_stream)
 
-        awaitable = self._context.embedding_a2a_requests.pop(self._name)
         # in case of MC modules
         is_mc_module: bool = isinstance(awaitable, Iterable)
         remapped_kjts: Optional[KeyedJaggedTensor] = None
@@ -740,19 +942,17 @@ class PrefetchPipelinedForward(BaseForward[PrefetchTrainPipelineContext]):
 
     # pyre-ignore [2, 24]
     def __call__(self, *input, **kwargs) -> Awaitable:
+        data = self._context.module_input_post_prefetch.pop(self._name, None)
         assert (
-            self._name in self._context.module_input_post_prefetch
+            data is not None
         ), "Invalid PrefetchPipelinedForward usage, please do not directly call model.forward()"
-        data = self._context.module_input_post_prefetch.pop(self._name)
         ctx = self._context.module_contexts_post_prefetch.pop(self._name)
 
         # Make sure that both result of input_dist and context
         # are properly transferred to the current stream.
         if self._stream is not None:
-            torch.get_device_module(self._device).current_stream().wait_stream(
-                self._stream
-            )
-            cur_stream = torch.get_device_module(self._device).current_stream()
+            cur_stream = self._device_module.current_stream()
+            cur_stream.wait_stream(self._stream)
 
             assert isinstance(
                 data, (torch.Tensor, Multistreamable)
@@ -772,23 +972,28 @@ class KJTAllToAllForward:
         self._splits = splits
         self._stagger = stagger
         self._splits_cumsum: List[int] = [0] + list(itertools.accumulate(splits))
+        # the process group is fixed, so are this rank's slice of keys
+        self._world_size: int = pg.size()
+        rank = dist.get_rank(pg)
+        self._local_keys_start: int = self._splits_cumsum[rank]
+        self._local_keys_end: int = self._splits_cumsum[rank + 1]
 
     def __call__(self, input: KeyedJaggedTensor) -> KJTSplitsAllToAllMeta:
         with torch.no_grad():
             assert len(input.keys()) == sum(self._splits)
-            rank = dist.get_rank(self._pg)
-            local_keys = input.keys()[
-                self._splits_cumsum[rank] : self._splits_cumsum[rank + 1]
-            ]
+            local_keys = input.keys()[self._local_keys_start : self._local_keys_end]
             input_splits = input.dist_splits(self._splits)
             device = input.values().device
-            splits_tensors = [
-                torch.tensor(splits, device=device) for splits in input_splits
-            ]
+            flat_splits = list(itertools.chain.from_iterable(input_splits))
             if not input.variable_stride_per_key():
-                splits_tensors.append(
-                    torch.tensor([input.stride()] * self._pg.size(), device=device)
-                )
+                flat_splits.extend([input.stride()] * self._world_size)
+            # all splits go to the device in a single copy, each entry has one
+            # split per rank so the rows of the copy are the splits tensors
+            splits_tensors = list(
+                _pin_and_move(torch.tensor(flat_splits), device)
+                .view(-1, self._world_size)
+                .unbind(0)
+            )
             return KJTSplitsAllToAllMeta(
                 pg=self._pg,
                 _input=input,
@@ -816,16 +1021,17 @@ class Tracer(torch.fx.Tracer):
     # remove this line.
     proxy_buffer_attributes = False
 
+    _leaf_types: Tuple[Type[object], ...] = (ShardedModule, FSDP, FSDP2)
+
     def __init__(self, leaf_modules: Optional[List[str]] = None) -> None:
         super().__init__()
-        self._leaf_modules: List[str] = leaf_modules if leaf_modules is not None else []
+        self._leaf_modules: Set[str] = (
+            set(leaf_modules) if leaf_modules is not None else set()
+        )
 
     def is_leaf_module(self, m: torch.nn.Module, module_qualified_name: str) -> bool:
-        if (
-            isinstance(m, ShardedModule)
-            or module_qualified_name in self._leaf_modules
-            or isinstance(m, FSDP)
-            or isinstance(m, FSDP2)
+        if module_qualified_name in self._leaf_modules or isinstance(
+            m, self._leaf_types
         ):
             return True
         return super().is_leaf_module(m, module_qualified_name)
@@ -854,9 +1060,8 @@ def _wait_for_batch(batch: In, stream: Optional[torch.Stream]) -> None:
     if stream is None:
         return
 
-    device = stream.device
-    torch.get_device_module(device).current_stream().wait_stream(stream)
-    cur_stream = torch.get_device_module(device).current_stream()
+    cur_stream = torch.get_device_module(stream.device).current_stream()
+    cur_stream.wait_stream(stream)
     assert isinstance(
         batch, (torch.Tensor, Multistreamable)
     ), f"{type(batch)} must implement Multistreamable interface"
@@ -869,11 +1074,17 @@ def _wait_for_events(
     stream: Optional[torch.Stream],
 ) -> None:
     """
-    Wait for any outstanding events for a given context
+    Wait for any outstanding events for a given context.
+    Makes `stream` wait on them directly, instead of entering it and waiting on
+    the current stream; without `stream` the current stream waits.
     """
 
-    for event in context.events:
-        event.wait()
+    if stream:
+        for event in context.events:
+            stream.wait_event(event)
+    else:
+        for event in context.events:
+            event.wait()
     context.events.clear()
     if stream:
         assert isinstance(
@@ -892,6 +1103,9 @@ def _start_data_dist(
         context.module_contexts_next_batch.clear()
         context.fused_splits_awaitables.clear()
 
+    # build the args of every module first, this runs the postprocs, so that the
+    # input dists below are issued back to back on the (dist) stream
+    module_args = []
     for module in pipelined_modules:
         forward = module.forward
         assert isinstance(
@@ -909,18 +1123,20 @@ def _start_data_dist(
         # False means this argument is getting while getattr
         # and this info was done in the _rewrite_model by tracing the
         # entire model to get the arg_info_list
-        args, kwargs = forward.args.build_args_kwargs(batch)
+        module_args.append((module, forward, *forward.args.build_args_kwargs(batch)))
 
+    names_per_pg: Dict[Optional[dist.ProcessGroup], List[str]] = defaultdict(list)
+    for module, forward, args, kwargs in module_args:
         # Start input distribution.
         module_ctx = module.create_context()
         if context.version == 0:
             context.module_contexts_next_batch[forward.name] = module_ctx
         else:
             context.module_contexts[forward.name] = module_ctx
-        context.input_dist_splits_requests[forward.name] = module.input_dist(
-            module_ctx, *args, **kwargs
-        )
-    _fuse_input_dist_splits(context)
+        request = module.input_dist(module_ctx, *args, **kwargs)
+        context.input_dist_splits_requests[forward.name] = request
+        names_per_pg[forward.splits_pg(request)].append(forward.name)
+    _fuse_input_dist_splits(context, names_per_pg)
 
 
 def _start_embedding_lookup(
@@ -942,16 +1158,27 @@ def _start_embedding_lookup(
     context.embedding_a2a_requests[module.forward.name] = output_dist_out
 
 
-def _fuse_input_dist_splits(context: TrainPipelineContext) -> None:
-    names_per_pg = defaultdict(list)
-    for name, request in context.input_dist_splits_requests.items():
-        pg = None
-        if isinstance(request, KJTListSplitsAwaitable):
-            for awaitable in request.awaitables:
-                if isinstance(awaitable, KJTSplitsAllToAllMeta):
-                    pg = awaitable.pg
-                    break
-        names_per_pg[pg].append(name)
+def _get_splits_pg(request: Awaitable[Any]) -> Optional[dist.ProcessGroup]:
+    if isinstance(request, KJTListSplitsAwaitable):
+        for awaitable in request.awaitables:
+            if isinstance(awaitable, KJTSplitsAllToAllMeta):
+                return awaitable.pg
+    return None
+
+
+def _fuse_input_dist_splits(
+    context: TrainPipelineContext,
+    names_per_pg: Optional[Dict[Optional[dist.ProcessGroup], List[str]]] = None,
+) -> None:
+    """
+    Fuses the input dist splits requests of the context per process group.
+    `names_per_pg` can be passed by callers that already know the grouping, which
+    otherwise is worked out from the requests.
+    """
+    if names_per_pg is None:
+        names_per_pg = defaultdict(list)
+        for name, request in context.input_dist_splits_requests.items():
+            names_per_pg[_get_splits_pg(request)].append(name)
 
     for pg, names in names_per_pg.items():
         context.fused_splits_awaitables.append(
@@ -980,14 +1207,19 @@ def _check_args_for_call_module(
     node: torch.fx.Node,
 ) -> bool:
     """
-    Recursively checks if args to a node is the result of a call_module.
+    Checks if a node or any of its transitive (positional) args is the result of a
+    call_module. Walks the graph iteratively, visiting shared nodes once.
     """
-    if node.op == "call_module":
-        return True
-
-    for arg in node.args:
-        if isinstance(arg, torch.fx.Node) and _check_args_for_call_module(arg):
+    stack = [node]
+    visited: Set[torch.fx.Node] = set()
+    while stack:
+        cur = stack.pop()
+        if cur in visited:
+            continue
+        visited.add(cur)
+        if cur.op == "call_module":
             return True
+        stack.extend(arg for arg in cur.args if isinstance(arg, torch.fx.Node))
 
     return False
 
@@ -995,15 +1227,26 @@ def _check_args_for_call_module(
 def _check_postproc_pipelineable(
     module: torch.nn.Module,
 ) -> bool:
-    for _, _ in module.named_parameters(recurse=True):
-        # Cannot have any trainable params for it to be pipelined
+    # Cannot have any trainable params for it to be pipelined
+    if next(module.parameters(recurse=True), None) is not None:
         logger.warning(
-            f"Module {module} cannot be pipelined as it has trainable parameters"
+            "Module %s cannot be pipelined as it has trainable parameters", module
         )
         return False
     return True
 
 
+# splits a placeholder key like `a.b[c][0]` into attribute names and item indices
+_PH_KEY_RE: re.Pattern[str] = re.compile(r"([^.\[\]]+)|\[([^\]]+)\]")
+
+
+def _ph_key_item(item: str) -> Union[str, int]:
+    try:
+        return int(item)
+    except ValueError:
+        return item
+
+
 def _find_postproc_module_recursive(
     module: torch.nn.Module,
     postproc_module_fqn: str,
@@ -1011,12 +1254,83 @@ def _find_postproc_module_recursive(
     """
     Finds the postproc module in the model.
     """
+    try:
+        return module.get_submodule(postproc_module_fqn)
+    except AttributeError:
+        pass
+    # fqns under a PipelinedPostproc skip its `_postproc_module` attribute, only
+    # its named_modules override knows them
     for name, child in module.named_modules():
         if name == postproc_module_fqn:
             return child
     return None
 
 
+# returned by a call_function handler when the node can't be resolved further
+_STOP_WALK = object()
+
+
+# pyre-ignore[3]
+def _walk_getattr(child_node: torch.fx.Node, arg_info: ArgInfo) -> Any:
+    # pyre-fixme[6]: For 2nd argument expected `str` but got Unknown
+    arg_info.add_step(ArgInfoStepFactory.get_attr(child_node.args[1]))
+    return child_node.args[0]
+
+
+# pyre-ignore[3]
+def _walk_getitem(child_node: torch.fx.Node, arg_info: ArgInfo) -> Any:
+    # pyre-fixme[6]: For 2nd argument expected `str` but got Unknown
+    arg_info.add_step(ArgInfoStepFactory.get_item(child_node.args[1]))
+    return child_node.args[0]
+
+
+# pyre-ignore[3]
+def _walk_tree_unflatten(child_node: torch.fx.Node, arg_info: ArgInfo) -> Any:
+    """
+    This is for the PT2 export path where we unflatten the input to reconstruct
+    the structure with the recorded tree spec.
+    """
+    step = arg_info.steps[0]
+    assert isinstance(step, GetItemArgInfoStep)
+    # pyre-fixme[16]
+    return child_node.args[0][step.item_index]
+
+
+# pyre-ignore[3]
+def _walk_kjt_init(child_node: torch.fx.Node, arg_info: ArgInfo) -> Any:
+    for arg_node in chain(child_node.args, child_node.kwargs.values()):
+        if isinstance(arg_node, torch.fx.Node) and _check_args_for_call_module(
+            arg_node
+        ):
+            return _STOP_WALK
+
+    if "values" in child_node.kwargs:
+        return child_node.kwargs["values"]
+    return child_node.args[1]
+
+
+# non-modifying call_function targets the arg walk can see through, keyed by target
+_CALL_FUNCTION_HANDLERS: Dict[
+    Callable[..., Any], Callable[[torch.fx.Node, ArgInfo], Any]
+] = {
+    getattr: _walk_getattr,
+    operator.getitem: _walk_getitem,
+    tree_unflatten: _walk_tree_unflatten,
+    KeyedJaggedTensor: _walk_kjt_init,
+}
+
+
+def _get_call_function_handler(
+    # pyre-ignore[2]
+    target: Any,
+) -> Optional[Callable[[torch.fx.Node, ArgInfo], Any]]:
+    try:
+        return _CALL_FUNCTION_HANDLERS.get(target)
+    except TypeError:
+        # unhashable target
+        return None
+
+
 class NodeArgsHelper:
     def __init__(
         self,
@@ -1032,6 +1346,9 @@ class NodeArgsHelper:
         self._default_stream = default_stream
         self._dist_stream = dist_stream
         self._pipelined_postprocs: Set[PipelinedPostproc] = set()
+        # resolved ArgInfo per (node, for_postproc_module), shared nodes are only
+        # walked once per graph
+        self._node_arg_infos: Dict[Tuple[Node, bool], Optional[ArgInfo]] = {}
 
     @property
     def pipelined_postprocs(self) -> Set[PipelinedPostproc]:
@@ -1042,26 +1359,26 @@ class NodeArgsHelper:
         module: torch.nn.Module,
         to_swap_module: torch.nn.Module,
         postproc_module_fqn: str,
-        path: str = "",
     ) -> torch.nn.Module:
         """
-        Swaps the postproc module in the model.
+        Swaps the postproc module in the model, following its fqn down from `module`.
+        Modules at or under an existing PipelinedPostproc are left as is.
         """
         if isinstance(module, PipelinedPostproc):
             return module
-
-        if path == postproc_module_fqn:
+        if not postproc_module_fqn:
             return to_swap_module
 
-        for name, child in module.named_children():
-            child = self._swap_postproc_module_recursive(
-                child,
-                to_swap_module,
-                postproc_module_fqn,
-                path + "." + name if path else name,
-            )
-            setattr(module, name, child)
+        *parent_names, name = postproc_module_fqn.split(".")
+        parent = module
+        for parent_name in parent_names:
+            parent = parent._modules.get(parent_name)
+            if parent is None or isinstance(parent, PipelinedPostproc):
+                return module
 
+        child = parent._modules.get(name)
+        if child is not None and not isinstance(child, PipelinedPostproc):
+            setattr(parent, name, to_swap_module)
         return module
 
     def _handle_constant(
@@ -1113,18 +1430,13 @@ class NodeArgsHelper:
             # pyre-fixme[16]
             ph_key: str = child_node.ph_key
             # example: ph_key = 'event_id_list_features_seqs[marketplace]'
-            ph_key = ph_key.replace("[", ".")
-            ph_keys = ph_key.split(".")
-            for key in ph_keys:
-                if "]" in key:
-                    k_ = key[:-1]
-                    try:
-                        k_ = int(k_)
-                    except ValueError:
-                        pass
-                    arg_info.append_step(ArgInfoStepFactory.get_item(k_))
+            for attr, item in _PH_KEY_RE.findall(ph_key):
+                if attr:
+                    arg_info.append_step(ArgInfoStepFactory.get_attr(attr))
                 else:
-                    arg_info.append_step(ArgInfoStepFactory.get_attr(key))
+                    arg_info.append_step(
+                        ArgInfoStepFactory.get_item(_ph_key_item(item))
+                    )
         else:
             # no-op
             arg_info.add_step(ArgInfoStepFactory.noop())
@@ -1140,7 +1452,8 @@ class NodeArgsHelper:
 
         if not self._pipeline_postproc:
             logger.warning(
-                f"Found module {postproc_module} that potentially modifies KJ. Train pipeline initialized with `pipeline_postproc=False` (default), so we assume KJT input modification. To allow torchrec to check if this module can be safely pipelined, please set `pipeline_postproc=True`"
+                "Found module %s that potentially modifies KJ. Train pipeline initialized with `pipeline_postproc=False` (default), so we assume KJT input modification. To allow torchrec to check if this module can be safely pipelined, please set `pipeline_postproc=True`",
+                postproc_module,
             )
             return None
 
@@ -1156,7 +1469,8 @@ class NodeArgsHelper:
 
         if not isinstance(postproc_module, torch.nn.Module):
             logger.warning(
-                f"Expected postproc_module to be nn.Module but was {type(postproc_module)}"
+                "Expected postproc_module to be nn.Module but was %s",
+                type(postproc_module),
             )
             return None
 
@@ -1179,11 +1493,12 @@ class NodeArgsHelper:
         )
         if num_found_safe_postproc_args == total_num_args:
             logger.info(
-                f"""Module {postproc_module} is a valid postproc module (no
+                """Module %s is a valid postproc module (no
                 trainable params and inputs can be derived from train batch input
                     via a series of either valid postproc modules or non-modifying
                     transformations) and will be applied during sparse data dist
-                    stage"""
+                    stage""",
+                postproc_module,
             )
 
             pipelined_postproc_module = PipelinedPostproc(
@@ -1211,6 +1526,24 @@ class NodeArgsHelper:
         # pyre-ignore
         arg,
         for_postproc_module: bool = False,
+    ) -> Optional[ArgInfo]:
+        if not isinstance(arg, torch.fx.Node):
+            return self._resolve_arg_info(arg, for_postproc_module)
+
+        key = (arg, for_postproc_module)
+        if key in self._node_arg_infos:
+            arg_info = self._node_arg_infos[key]
+        else:
+            arg_info = self._resolve_arg_info(arg, for_postproc_module)
+            self._node_arg_infos[key] = arg_info
+        # callers may extend the steps, so never hand out the cached instance
+        return None if arg_info is None else ArgInfo(list(arg_info.steps))
+
+    def _resolve_arg_info(
+        self,
+        # pyre-ignore
+        arg,
+        for_postproc_module: bool = False,
     ) -> Optional[ArgInfo]:
         arg_info = ArgInfo([])
         while True:
@@ -1223,65 +1556,13 @@ class NodeArgsHelper:
                 return self._handle_placeholder(arg, arg_info)
             elif child_node.op == "call_module":
                 return self._handle_module(arg, arg_info)
-            elif (
-                child_node.op == "call_function"
-                and child_node.target.__module__ == "builtins"
-                # pyre-fixme[16]
-                and child_node.target.__name__ == "getattr"
-            ):
-                arg_info.add_step(
-                    # pyre-fixme[6]: For 2nd argument expected `str` but got Unknown
-                    ArgInfoStepFactory.get_attr(child_node.args[1])
-                )
-                arg = child_node.args[0]
-            elif (
-                child_node.op == "call_function"
-                and child_node.target.__module__ == "_operator"
-                # pyre-fixme[16]
-                and child_node.target.__name__ == "getitem"
-            ):
-                arg_info.add_step(
-                    # pyre-fixme[6]: For 2nd argument expected `str` but got Unknown
-                    ArgInfoStepFactory.get_item(child_node.args[1])
-                )
-                arg = child_node.args[0]
-            elif (
-                child_node.op == "call_function"
-                and child_node.target.__module__ == "torch.utils._pytree"
-                # pyre-fixme[16]
-                and child_node.target.__name__ == "tree_unflatten"
-            ):
-                """
-                This is for the PT2 export path where we unflatten the input to reconstruct
-                the structure with the recorded tree spec.
-                """
-                step = arg_info.steps[0]
-                assert isinstance(step, GetItemArgInfoStep)
-                # pyre-fixme[16]
-                arg = child_node.args[0][step.item_index]
-            elif (
-                child_node.op == "call_function"
-                and child_node.target.__module__ == "torchrec.sparse.jagged_tensor"
-                # pyre-fixme[16]
-                and child_node.target.__name__ == "KeyedJaggedTensor"
-            ):
-                call_module_found = False
-
-                for arg_node in chain(child_node.args, child_node.kwargs.values()):
-                    if isinstance(
-                        arg_node, torch.fx.Node
-                    ) and _check_args_for_call_module(arg_node):
-                        call_module_found = True
-                        break
-
-                if call_module_found:
+            elif child_node.op == "call_function":
+                handler = _get_call_function_handler(child_node.target)
+                if handler is None:
+                    break
+                arg = handler(child_node, arg_info)
+                if arg is _STOP_WALK:
                     break
-
-                if "values" in child_node.kwargs:
-                    arg = child_node.kwargs["values"]
-                else:
-                    arg = child_node.args[1]
-
             elif child_node.op == "call_method" and child_node.target == "get":
                 # pyre-ignore[6]
                 arg_info.add_step(ArgInfoStepFactory.get_item(child_node.args[1]))
@@ -1321,6 +1602,32 @@ class NodeArgsHelper:
                 arg_info_list.append(arg_info)
         return arg_info_list, num_found
 
+    def _get_node_kwargs_helper(
+        self,
+        # pyre-ignore
+        kwargs,
+        for_postproc_module: bool = False,
+    ) -> Tuple[Dict[str, ArgInfo], int]:
+        """
+        Same as `_get_node_args_helper`, but for the kwargs of a node, keeping the
+        `ArgInfo`s under their kwarg names.
+        """
+        num_found = 0
+        kwarg_infos = {}
+        for name, arg in kwargs.items():
+            if not for_postproc_module and arg is None:
+                kwarg_infos[name] = ArgInfo([ArgInfoStepFactory.from_scalar(None)])
+                num_found += 1
+                continue
+            arg_info = self._get_node_args_helper_inner(
+                arg,
+                for_postproc_module,
+            )
+            if arg_info is not None:
+                num_found += 1
+                kwarg_infos[name] = arg_info
+        return kwarg_infos, num_found
+
     def get_node_args(
         self,
         node: Node,
@@ -1330,14 +1637,11 @@ class NodeArgsHelper:
             node.args,
             for_postproc_module,
         )
-        kwargs_arg_info_list, kwargs_found = self._get_node_args_helper(
-            node.kwargs.values(),
+        kwargs_info_list, kwargs_found = self._get_node_kwargs_helper(
+            node.kwargs,
             for_postproc_module,
         )
 
-        # Replace with proper names for kwargs
-        kwargs_info_list = dict(zip(node.kwargs, kwargs_arg_info_list))
-
         return CallArgs(pos_arg_info_list, kwargs_info_list), args_found + kwargs_found
 
 
@@ -1353,7 +1657,8 @@ def _get_leaf_module_names_helper(
     which suggests this ShardedModule-free module should NOT be treated as a leaf module
     """
     sharded_children = set()
-    for name, child in model.named_children():
+    children = list(model.named_children())
+    for name, child in children:
         curr_path = path + name
         if isinstance(child, ShardedModule):
             sharded_children.add(name)
@@ -1368,7 +1673,7 @@ def _get_leaf_module_names_helper(
 
     # only do this for hybrid module (has sharded child)
     if len(sharded_children) > 0:
-        for name, child in model.named_children():
+        for name, child in children:
             if name in sharded_children:
                 continue
             # assume module is leaf node unless annotated otherwise
@@ -1396,7 +1701,8 @@ def _get_leaf_module_names(model: torch.nn.Module) -> List[str]:
 
 def _jit_modules(module: torch.nn.Module, path: str, optional: bool = True) -> bool:
     sharded_children = set()
-    for name, child in module.named_children():
+    children = list(module.named_children())
+    for name, child in children:
         curr_path = path + name
         if isinstance(child, ShardedModule):
             sharded_children.add(name)
@@ -1406,18 +1712,18 @@ def _jit_modules(module: torch.nn.Module, path: str, optional: bool = True) -> b
                 sharded_children.add(name)
 
     if len(sharded_children) > 0:
-        for name, child in module.named_children():
+        for name, child in children:
             if name not in sharded_children:
                 try:
                     jit_child = torch.jit.script(child)
                     setattr(module, name, jit_child)
-                    logger.info(f"jit.script applied to {path + name}.")
+                    logger.info("jit.script applied to %s.", path + name)
                 except Exception as error:
                     if not optional:
                         raise
                     else:
                         logger.info(
-                            f"Warning: failed to jit.script {path + name}: {error}."
+                            "Warning: failed to jit.script %s: %s.", path + name, error
                         )
 
     return len(sharded_children) > 0
@@ -1550,14 +1856,16 @@ def _rewrite_model(  # noqa C901
         total_num_args = len(node.args) + len(node.kwargs)
         # only work on node with input(s), we don't expect zero input count for sharded module
         if total_num_args == 0:
-            logger.warning(f"Module '{node.target}' is a ShardedModule with zero input")
+            logger.warning(
+                "Module '%s' is a ShardedModule with zero input", node.target
+            )
             continue
 
         # List[ArgInfo]: for rebuilding the input arguments, while the num verifies if missing any
         arg_info_list, num_found = args_helper.get_node_args(node)
 
         if num_found == total_num_args:
-            logger.info(f"Module '{node.target}' will be pipelined")
+            logger.info("Module '%s' will be pipelined", node.target)
             child = sharded_modules[node.target]
             original_forwards.append(child.forward)
             # pyre-ignore[8] Incompatible attribute type
@@ -1571,7 +1879,8 @@ def _rewrite_model(  # noqa C901
             pipelined_forwards.append(child)
         else:
             logger.warning(
-                f"Module '{node.target}' will NOT be pipelined, due to input modifications"
+                "Module '%s' will NOT be pipelined, due to input modifications",
+                node.target,
             )
             non_pipelined_sharded_modules.append(node.target)
 
@@ -1628,8 +1937,26 @@ def _override_input_dist_forwards(
     return original_kjt_dist_forwards
 
 
-def get_h2d_func(batch: In, device: torch.device) -> Pipelineable:
-    return batch.to(device, non_blocking=True)
+def get_h2d_func(
+    batch: In,
+    device: torch.device,
+    stream: Optional[torch.Stream] = None,
+) -> Pipelineable:
+    """
+    Copies `batch` to `device`, on `stream` if given. The copy only overlaps with
+    host work if the batch is in pinned memory, e.g. from a dataloader with
+    `pin_memory=True`.
+    """
+    if stream is None:
+        return batch.to(device, non_blocking=True)
+    with torch.get_device_module(device).stream(stream):
+        return batch.to(device, non_blocking=True)
+
+
+def _should_pin(batch: In) -> bool:
+    if isinstance(batch, torch.Tensor):
+        return batch.device.type == "cpu" and not batch.is_pinned()
+    return hasattr(batch, "pin_memory")
 
 
 class DataLoadingThread(Thread, Generic[In]):
@@ -1640,64 +1967,84 @@ class DataLoadingThread(Thread, Generic[In]):
         to_device_non_blocking: bool,
         memcpy_stream_priority: int = 0,
         memcpy_stream: Optional[torch.Stream] = None,
+        buffer_size: int = 1,
+        pin_memory: bool = False,
     ) -> None:
         super().__init__(name="DataLoadingThread")
+        assert buffer_size >= 1, f"buffer_size must be positive, got {buffer_size}"
         self._stop: bool = False
         self.daemon = True  # Mark as daemon thread so that Python will not wait for it at shutdown.
         self._dataloader_iter = dataloader_iter
-        self._buffer_empty_event: Event = Event()
-        self._buffer_filled_event: Event = Event()
+        self._device_module = torch.get_device_module(device)
+        # up to `buffer_size` batches are loaded and copied ahead of the consumer,
+        # each one takes a token from `_free_slots` until it's consumed
+        self._free_slots: SimpleQueue[None] = SimpleQueue()
+        for _ in range(buffer_size):
+            self._free_slots.put(None)
         if memcpy_stream is None:
             self._memcpy_stream: Optional[torch.Stream] = (
-                torch.get_device_module(device).Stream(priority=memcpy_stream_priority)
-                if device.type in ["cuda", "mtia"]
+                self._device_module.Stream(priority=memcpy_stream_priority)
+                if device.type in _STREAM_DEVICE_TYPES
                 else None
             )
         else:
             self._memcpy_stream = memcpy_stream
         self._device = device
+        self._stream_context: Callable[
+            [Optional[torch.Stream]], AbstractContextManager[object]
+        ] = self._device_module.stream
         self._to_device_non_blocking = to_device_non_blocking
-        self._buffered: Optional[In] = None
-        self._buffer_empty_event.set()
+        # a non-blocking copy from pageable memory is synchronous, so batches can be
+        # pinned first to overlap it with compute; opt-in as the batch must be on CPU
+        self._pin_batch: bool = (
+            pin_memory
+            and to_device_non_blocking
+            and device.type in _STREAM_DEVICE_TYPES
+        )
+        # copied batches, `None` marks the end (stopped or exhausted)
+        self._buffered: SimpleQueue[Optional[In]] = SimpleQueue()
 
     def run(self) -> None:
-        if self._device.type == "cuda" and torch.cuda.is_available():
-            # set the current device the same as the one used in the main thread
-            torch.cuda.set_device(self._device)
-        elif self._device.type == "mtia" and torch.mtia.is_available():
+        if (
+            self._device.type in _STREAM_DEVICE_TYPES
+            and self._device_module.is_available()
+        ):
             # set the current device the same as the one used in the main thread
-            torch.mtia.set_device(self._device)
+            self._device_module.set_device(self._device)
 
         while not self._stop:
-            self._buffer_empty_event.wait()
-            # Set the filled event to unblock progress() and return.
+            self._free_slots.get()
+            # Mark the end to unblock progress() and return.
             if self._stop:
-                self._buffer_filled_event.set()
+                self._buffered.put(None)
                 return
-            with record_function("## load_batch ##"):
+            with _maybe_record_function("## load_batch ##"):
                 try:
                     batch = next(self._dataloader_iter)
                 except StopIteration:
                     self._stop = True
-                    self._buffer_filled_event.set()
+                    self._buffered.put(None)
                     return
-            with record_function("## copy_batch_to_gpu ##"):
-                with torch.get_device_module(self._device).stream(self._memcpy_stream):
-                    self._buffered = cast(
-                        In,
-                        batch.to(
-                            self._device, non_blocking=self._to_device_non_blocking
-                        ),
+            if self._pin_batch and _should_pin(batch):
+                with _maybe_record_function("## pin_batch ##"):
+                    batch = batch.pin_memory()
+            with _maybe_record_function("## copy_batch_to_gpu ##"):
+                with self._stream_context(self._memcpy_stream):
+                    self._buffered.put(
+                        cast(
+                            In,
+                            batch.to(
+                                self._device, non_blocking=self._to_device_non_blocking
+                            ),
+                        )
                     )
-                self._buffer_empty_event.clear()
-                self._buffer_filled_event.set()
 
     def stop(self) -> None:
         logger.info("Stopping data loading thread...")
         self._stop = True
-        # Unblock any thread that are waiting for these events.
-        self._buffer_filled_event.set()
-        self._buffer_empty_event.set()
+        # Unblock any thread that are waiting on the queues.
+        self._buffered.put(None)
+        self._free_slots.put(None)
         logger.info("Data loading thread stopped.")
 
     def get_next_batch(self, none_throws: bool = False) -> Optional[In]:
@@ -1708,15 +2055,14 @@ class DataLoadingThread(Thread, Generic[In]):
         This function is not thread safe. We assume this is only invoked from
         the main thread in the training loop.
         """
-        self._buffer_filled_event.wait()
-        batch = self._buffered
+        batch = self._buffered.get()
         if batch is None:
+            # stopped or exhausted, put the marker back so later calls don't block
+            self._buffered.put(None)
             if none_throws:
                 raise StopIteration
             return None
-        self._buffered = None
-        self._buffer_filled_event.clear()
-        self._buffer_empty_event.set()
+        self._free_slots.put(None)
         return batch
 
 
@@ -1730,27 +2076,32 @@ def _prefetch_embeddings(
     default_stream: Optional[torch.Stream],
 ) -> Dict[str, KJTList]:
     data_per_sharded_module = {}
-    for sharded_module in pipelined_modules:
-        forward = sharded_module.forward
-        assert isinstance(forward, PrefetchPipelinedForward)
-        assert forward._name in context.input_dist_tensors_requests
-        request = context.input_dist_tensors_requests.pop(forward._name)
-        assert isinstance(request, Awaitable)
-        with record_function(f"## _prefetch_embeddings {context.index} ##"):
-            # Finish waiting on the dist_stream,
-            # in case some delayed stream scheduling happens during the wait() call.
-            with stream_context(data_dist_stream):
-                data = request.wait()
-
-        # Make sure that both result of input_dist and context
-        # are properly transferred to the current stream.
-        module_context = context.module_contexts[forward._name]
-        if data_dist_stream is not None:
-            torch.get_device_module(device).current_stream().wait_stream(
-                data_dist_stream
-            )
-            cur_stream = torch.get_device_module(device).current_stream()
-
+    names = []
+    with _maybe_record_function("## _prefetch_embeddings %s ##", context.index):
+        # Finish waiting on the dist_stream,
+        # in case some delayed stream scheduling happens during the wait() call.
+        with stream_context(data_dist_stream):
+            for sharded_module in pipelined_modules:
+                forward = sharded_module.forward
+                assert isinstance(forward, PrefetchPipelinedForward)
+                name = forward._name
+                request = context.input_dist_tensors_requests.pop(name, None)
+                assert isinstance(request, Awaitable)
+                data_per_sharded_module[name] = request.wait()
+                names.append(name)
+
+    # Make sure that both result of input_dist and context
+    # are properly transferred to the current stream, all modules share the
+    # dist stream so a single wait covers them
+    cur_stream = None
+    if data_dist_stream is not None:
+        cur_stream = torch.get_device_module(device).current_stream()
+        cur_stream.wait_stream(data_dist_stream)
+
+    for sharded_module, name in zip(pipelined_modules, names):
+        data = data_per_sharded_module[name]
+        module_context = context.module_contexts[name]
+        if cur_stream is not None:
             assert isinstance(
                 data, (torch.Tensor, Multistreamable)
             ), f"{type(data)} must implement Multistreamable interface"
@@ -1767,18 +2118,27 @@ def _prefetch_embeddings(
             dist_input=data,
             forward_stream=default_stream,
         )
-        data_per_sharded_module[forward._name] = data
     return data_per_sharded_module
 
 
-@contextlib.contextmanager
 def use_context_for_postprocs(
     pipelined_postprocs: List[PipelinedPostproc],
     next_batch_context: TrainPipelineContext,
-) -> Generator[None, None, None]:
+) -> AbstractContextManager[None]:
     """
     Temporarily set pipelined postproc context for next iter to populate cache.
     """
+    if not pipelined_postprocs:
+        # common case, nothing to swap
+        return contextlib.nullcontext()
+    return _use_context_for_postprocs(pipelined_postprocs, next_batch_context)
+
+
+@contextlib.contextmanager
+def _use_context_for_postprocs(
+    pipelined_postprocs: List[PipelinedPostproc],
+    next_batch_context: TrainPipelineContext,
+) -> Generator[None, None, None]:
     # Save original context for model fwd
     original_contexts = [p.get_context() for p in pipelined_postprocs]
 
@@ -1860,6 +2220,9 @@ class SparseDataDistUtil(Generic[In]):
         self.initialized = False
         self._pipelined_modules: List[ShardedModule] = []
         self._pipelined_postprocs: List[PipelinedPostproc] = []
+        # only change on (re)attach, see _initialize_or_reattach
+        self._pipelined_modules_fqns_cache: FrozenSet[str] = frozenset()
+        self._pipelined_postprocs_fqns_cache: FrozenSet[str] = frozenset()
         self.fwd_hook: Optional[RemovableHandle] = None
         self._device: torch.device = data_dist_stream.device
 
@@ -1867,7 +2230,7 @@ class SparseDataDistUtil(Generic[In]):
             [Optional[torch.Stream]], torch.cuda.StreamContext
         ] = (
             torch.get_device_module(self._device).stream
-            if self._device.type in ["cuda", "mtia"]
+            if self._device.type in _STREAM_DEVICE_TYPES
             else torch.cuda.stream
         )
 
@@ -1884,7 +2247,7 @@ class SparseDataDistUtil(Generic[In]):
 
         self._default_stream: Optional[torch.Stream] = (
             (torch.get_device_module(self._device).Stream())
-            if self._device.type in ["cuda", "mtia"]
+            if self._device.type in _STREAM_DEVICE_TYPES
             else None
         )
         # When data iterator is exhausted, contexts should continue advancing until
@@ -1923,11 +2286,11 @@ class SparseDataDistUtil(Generic[In]):
     def _have_pipelined_postprocs(self) -> bool:
         return len(self._pipelined_postprocs) > 0
 
-    def _pipelined_modules_fqns(self) -> Set[str]:
-        return {module.forward._name for module in self._pipelined_modules}
+    def _pipelined_modules_fqns(self) -> FrozenSet[str]:
+        return self._pipelined_modules_fqns_cache
 
-    def _pipelined_postprocs_fqns(self) -> Set[str]:
-        return {module._fqn for module in self._pipelined_postprocs}
+    def _pipelined_postprocs_fqns(self) -> FrozenSet[str]:
+        return self._pipelined_postprocs_fqns_cache
 
     # === Debugging helpers === #
 
@@ -1999,7 +2362,7 @@ class SparseDataDistUtil(Generic[In]):
         return self._contexts[0]
 
     def _assert_input_dist_tensors(
-        self, context: TrainPipelineContext, expected_fqns: Set[str]
+        self, context: TrainPipelineContext, expected_fqns: FrozenSet[str]
     ) -> None:
         specified_keys = context.input_dist_tensors_requests.keys()
         assert (
@@ -2007,7 +2370,7 @@ class SparseDataDistUtil(Generic[In]):
         ), f"Context(idx:{context.index}).input_dist_tensors_requests {specified_keys} != pipelined modules fqns {expected_fqns}"
 
     def _assert_module_contexts(
-        self, context: TrainPipelineContext, expected_fqns: Set[str]
+        self, context: TrainPipelineContext, expected_fqns: FrozenSet[str]
     ) -> None:
         specified_keys = context.module_contexts.keys()
         assert (
@@ -2015,7 +2378,7 @@ class SparseDataDistUtil(Generic[In]):
         ), f"Context(idx:{context.index}).module_contexts {specified_keys} != pipelined modules fqns {expected_fqns}"
 
     def _assert_module_contexts_post_prefetch(
-        self, context: PrefetchTrainPipelineContext, expected_fqns: Set[str]
+        self, context: PrefetchTrainPipelineContext, expected_fqns: FrozenSet[str]
     ) -> None:
         specified_keys = context.module_contexts_post_prefetch.keys()
         assert (
@@ -2023,7 +2386,7 @@ class SparseDataDistUtil(Generic[In]):
         ), f"Context(idx:{context.index}).module_contexts_post_prefetch {specified_keys} != pipelined modules fqns {expected_fqns}"
 
     def _assert_module_input_post_prefetch(
-        self, context: PrefetchTrainPipelineContext, expected_fqns: Set[str]
+        self, context: PrefetchTrainPipelineContext, expected_fqns: FrozenSet[str]
     ) -> None:
         specified_keys = context.module_input_post_prefetch.keys()
         assert (
@@ -2138,6 +2501,12 @@ class SparseDataDistUtil(Generic[In]):
             pipeline_postproc=self._pipeline_postproc,
             default_stream=self._default_stream,
         )
+        self._pipelined_modules_fqns_cache = frozenset(
+            module.forward._name for module in self._pipelined_modules
+        )
+        self._pipelined_postprocs_fqns_cache = frozenset(
+            module._fqn for module in self._pipelined_postprocs
+        )
         # Setting the stage for the first batch
         # initialize input dist
         _start_data_dist(self._pipelined_modules, batch, self._start_dist_context())
@@ -2190,7 +2559,7 @@ class SparseDataDistUtil(Generic[In]):
             self._initialize_or_reattach(batch)
 
         ctx = self._start_dist_context()
-        with record_function(f"## start_sparse_data_dist {ctx.index} ##"):
+        with _maybe_record_function("## start_sparse_data_dist %s ##", ctx.index):
             with use_context_for_postprocs(self._pipelined_postprocs, ctx):
                 _start_data_dist(self._pipelined_modules, batch, ctx)
 
@@ -2202,11 +2571,10 @@ class SparseDataDistUtil(Generic[In]):
         and populates the context with them.
         """
         ctx = self._wait_dist_context()
-        with record_function(f"## wait_sparse_data_dist {ctx.index} ##"):
+        with _maybe_record_function("## wait_sparse_data_dist %s ##", ctx.index):
             with self._stream_context(self.data_dist_stream):
                 for names, awaitable in ctx.fused_splits_awaitables:
-                    for name, request in zip(names, awaitable.wait()):
-                        ctx.input_dist_tensors_requests[name] = request
+                    ctx.input_dist_tensors_requests.update(zip(names, awaitable.wait()))
         # these won't be used by the rest of the pipeline, so just deleting them to free
         # the memory they occupy
         ctx.input_dist_splits_requests.clear()
@@ -2234,13 +2602,11 @@ class SparseDataDistUtil(Generic[In]):
             # TODO (eugenykolpakov): investigate if these can be moved outside of the `with stream_context(...)`  block
             # This might impact memory fragmentation (since CUDA caching allocator is stream-aware),
             # so need to check how memory behaves with different streams
-            for sharded_module in self._pipelined_modules:
-                forward = sharded_module.forward
-                data = data_per_pipelined_module[forward._name]
-                ctx.module_input_post_prefetch[forward._name] = data
-                ctx.module_contexts_post_prefetch[forward._name] = (
-                    ctx.module_contexts.pop(forward._name)
-                )
+            # module contexts are only created for pipelined modules, so all of them
+            # move over
+            ctx.module_input_post_prefetch.update(data_per_pipelined_module)
+            ctx.module_contexts_post_prefetch.update(ctx.module_contexts)
+            ctx.module_contexts.clear()
         return batch
 
     def load_prefetch(self) -> None:
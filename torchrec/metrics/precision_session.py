@@ -8,7 +8,7 @@
 # pyre-strict
 
 import logging
-from typing import Any, cast, Dict, List, Optional, Set, Type, Union
+from typing import Any, cast, Dict, List, Optional, Set, Tuple, Type, Union
 
 import torch
 from torch import distributed as dist
@@ -22,7 +22,7 @@ from torchrec.metrics.rec_metric import (
     RecMetricException,
 )
 from torchrec.metrics.recall_session import (
-    _calc_num_true_pos,
+    _matching_session_ids,
     _validate_model_outputs,
     ranking_within_session,
 )
@@ -33,29 +33,34 @@ NUM_TRUE_POS = "num_true_pos"
 NUM_FALSE_POS = "num_false_pos"
 
 
-def _calc_num_false_pos(
+def _calc_num_true_and_false_pos(
     labels: torch.Tensor, predictions: torch.Tensor, weights: torch.Tensor
-) -> torch.Tensor:
+) -> Tuple[torch.Tensor, torch.Tensor]:
     # predictions are expected to be 0 or 1 integers.
-    num_false_pos = torch.sum(
-        weights * (1 - labels) * (predictions == 1).double(), dim=-1
-    )
-    return num_false_pos
+    weighted_pos_predictions = weights * (predictions == 1).double()
+    num_true_pos = torch.sum(weighted_pos_predictions * labels, dim=-1)
+    # sum(w * pos * (1 - labels)) == sum(w * pos) - sum(w * pos * labels)
+    num_false_pos = torch.sum(weighted_pos_predictions, dim=-1) - num_true_pos
+    return num_true_pos, num_false_pos
 
 
 def _calc_precision(
     num_true_pos: torch.Tensor, num_false_pos: torch.Tensor
 ) -> torch.Tensor:
     # if num_true_pos + num_false_pos == 0 then we set precision = NaN by default.
-    precision = torch.tensor([float("nan")])
-    if (num_true_pos + num_false_pos).item() != 0:
-        precision = num_true_pos / (num_true_pos + num_false_pos)
-    else:
+    # Selected on device to avoid a host sync on every compute, so the warning is
+    # only checked for when the states live on CPU.
+    num_pos_predictions = num_true_pos + num_false_pos
+    if num_pos_predictions.device.type == "cpu" and not num_pos_predictions.all():
         logger.warning(
             "precision = NaN. Likely, it means that there were no positive predictions passed to the metric yet."
             " Please, debug if you expect every batch to include positive predictions."
         )
-    return precision
+    return torch.where(
+        num_pos_predictions != 0,
+        num_true_pos / num_pos_predictions,
+        torch.full_like(num_pos_predictions, float("nan")),
+    )
 
 
 class PrecisionSessionMetricComputation(RecMetricComputation):
@@ -126,8 +131,8 @@ class PrecisionSessionMetricComputation(RecMetricComputation):
             )
         _validate_model_outputs(labels, predictions, weights, session)
 
-        predictions = predictions.double()
-        labels = labels.double()
+        # predictions (and labels, when ranked) are only compared, which is exact in
+        # any dtype; the double weights promote the products in the sums
         weights = weights.double()
 
         num_samples = predictions.shape[-1]
@@ -165,17 +170,23 @@ class PrecisionSessionMetricComputation(RecMetricComputation):
         weights: torch.Tensor,
         session: torch.Tensor,
     ) -> Dict[str, torch.Tensor]:
-        predictions_ranked = ranking_within_session(predictions, session)
+        # shared by both rankings when labels are ranked too
+        matching_session_id = _matching_session_ids(session, predictions.size(0))
+        predictions_ranked = ranking_within_session(
+            predictions, session, matching_session_id
+        )
         # pyre-fixme[58]: `<` is not supported for operand types `Tensor` and
         #  `Optional[int]`.
-        predictions_labels = (predictions_ranked < self.top_threshold).to(torch.int32)
+        # the bool masks are used as is, they promote in the weighted sums below
+        predictions_labels = predictions_ranked < self.top_threshold
         if self.run_ranking_of_labels:
-            labels_ranked = ranking_within_session(labels, session)
+            labels_ranked = ranking_within_session(labels, session, matching_session_id)
             # pyre-fixme[58]: `<` is not supported for operand types `Tensor` and
             #  `Optional[int]`.
-            labels = (labels_ranked < self.top_threshold).to(torch.int32)
-        num_true_pos = _calc_num_true_pos(labels, predictions_labels, weights)
-        num_false_pos = _calc_num_false_pos(labels, predictions_labels, weights)
+            labels = labels_ranked < self.top_threshold
+        num_true_pos, num_false_pos = _calc_num_true_and_false_pos(
+            labels, predictions_labels, weights
+        )
 
         return {NUM_TRUE_POS: num_true_pos, NUM_FALSE_POS: num_false_pos}
 
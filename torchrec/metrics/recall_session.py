@@ -42,18 +42,27 @@ def _validate_model_outputs(
     assert labels.shape == sessions.shape
 
 
+def _matching_session_ids(session: torch.Tensor, n_tasks: int) -> torch.Tensor:
+    # pairwise mask of examples that belong to the same session
+    return session.view(-1, n_tasks) == session.view(n_tasks, -1)
+
+
 def ranking_within_session(
     predictions: torch.Tensor,
     session: torch.Tensor,
+    matching_session_id: Optional[torch.Tensor] = None,
 ) -> torch.Tensor:
     # rank predictions that belong to the same session
+    # `matching_session_id` can be passed to reuse the pairwise session mask
+    # (see `_matching_session_ids`) when ranking several tensors by the same session
 
     #  Example:
     #  predictions = [1.0, 0.0, 0.51, 0.8, 1.0, 0.0, 0.51, 0.8, 1.0, 0.0, 0.51, 0.8]
     #  sessions =    [1, 1, 1, 1, 1, 1, 1, -1, -1, -1, -1, -1]
     #  return =      [0, 5, 3, 2, 1, 6, 4, 1, 0, 4, 3, 2]
     n_tasks = predictions.size(0)
-    matching_session_id = session.view(-1, n_tasks) == session.view(n_tasks, -1)
+    if matching_session_id is None:
+        matching_session_id = _matching_session_ids(session, n_tasks)
     predictions_relation = predictions.view(-1, n_tasks) >= predictions.view(
         n_tasks, -1
     )
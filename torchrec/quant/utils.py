@@ -8,7 +8,7 @@
 # pyre-strict
 
 
-from typing import Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import torch
 from torch import nn
@@ -31,10 +31,9 @@ def populate_fx_names(
         for emb_configs, emb_module in zip(
             quant_ebc._key_to_tables, quant_ebc._emb_modules
         ):
-            table_names = []
-            for config in emb_configs:
-                table_names.append(config.name)  # pyre-ignore[16]
-            joined_table_names = ",".join(table_names)
+            joined_table_names = ",".join(
+                config.name for config in emb_configs  # pyre-ignore[16]
+            )
             # pyre-fixme[16]: `Module` has no attribute `_fx_path`.
             emb_module._fx_path = f"emb_module.{joined_table_names}"
     elif isinstance(quant_ebc, ShardedQuantEmbeddingBagCollection):
@@ -50,20 +49,24 @@ def populate_fx_names(
                 rank_fx_path = f"{embedding_fx_path}.rank_{rank}"
                 rank_module._fx_path = rank_fx_path
                 for group, group_module in enumerate(rank_module._emb_modules):
-                    group_module._fx_path = f"{rank_fx_path}.group_{group}"
-                    group_module._emb_module._fx_path = (
-                        f"{rank_fx_path}.group_{group}.tbe"
-                    )
+                    group_fx_path = f"{rank_fx_path}.group_{group}"
+                    group_module._fx_path = group_fx_path
+                    group_module._emb_module._fx_path = f"{group_fx_path}.tbe"
 
 
 def recursive_populate_fx_names(module: nn.Module) -> None:
-    if isinstance(module, QuantEmbeddingBagCollection) or isinstance(
-        module, ShardedQuantEmbeddingBagCollection
-    ):
-        populate_fx_names(module)
-        return
-    for submodule in module.children():
-        recursive_populate_fx_names(submodule)
+    # walked with an explicit stack, without descending into the (sharded) quant
+    # EBCs found, so deep models don't pay a python frame per submodule
+    stack = [module]
+    while stack:
+        submodule = stack.pop()
+        if isinstance(
+            submodule,
+            (QuantEmbeddingBagCollection, ShardedQuantEmbeddingBagCollection),
+        ):
+            populate_fx_names(submodule)
+        else:
+            stack.extend(submodule.children())
 
 
 def meta_to_cpu_placement(module: torch.nn.Module) -> None:
@@ -80,34 +83,42 @@ def meta_to_cpu_placement(module: torch.nn.Module) -> None:
 def _meta_to_cpu_placement(
     module: nn.Module, root_module: nn.Module, name: Optional[str] = None
 ) -> None:
-    if (
-        name is not None
-        and isinstance(module, QuantEmbeddingBagCollection)
-        and module.device.type == "meta"
-    ):
-        qebc_cpu = QuantEmbeddingBagCollection(
-            tables=module.embedding_bag_configs(),
-            is_weighted=module.is_weighted(),
-            device=torch.device("cpu"),
-            output_dtype=module.output_dtype(),
-            register_tbes=module.register_tbes,
-            row_alignment=module.row_alignment,
-        )
-        setattr(root_module, name, qebc_cpu)
-    elif (
-        name is not None
-        and isinstance(module, QuantEmbeddingCollection)
-        and module.device.type == "meta"
-    ):
-        qec_cpu = QuantEmbeddingCollection(
-            tables=module.embedding_configs(),
-            device=torch.device("cpu"),
-            need_indices=module.need_indices(),
-            output_dtype=module.output_dtype(),
-            register_tbes=module.register_tbes,
-            row_alignment=module.row_alignment,
-        )
-        setattr(root_module, name, qec_cpu)
-    else:
-        for name, submodule in module.named_children():
-            _meta_to_cpu_placement(submodule, module, name)
+    # worklist of (module, parent, name in parent); replaced modules aren't descended
+    worklist: List[Tuple[nn.Module, nn.Module, Optional[str]]] = [
+        (module, root_module, name)
+    ]
+    while worklist:
+        module, root_module, name = worklist.pop()
+        if (
+            name is not None
+            and isinstance(module, QuantEmbeddingBagCollection)
+            and module.device.type == "meta"
+        ):
+            qebc_cpu = QuantEmbeddingBagCollection(
+                tables=module.embedding_bag_configs(),
+                is_weighted=module.is_weighted(),
+                device=torch.device("cpu"),
+                output_dtype=module.output_dtype(),
+                register_tbes=module.register_tbes,
+                row_alignment=module.row_alignment,
+            )
+            setattr(root_module, name, qebc_cpu)
+        elif (
+            name is not None
+            and isinstance(module, QuantEmbeddingCollection)
+            and module.device.type == "meta"
+        ):
+            qec_cpu = QuantEmbeddingCollection(
+                tables=module.embedding_configs(),
+                device=torch.device("cpu"),
+                need_indices=module.need_indices(),
+                output_dtype=module.output_dtype(),
+                register_tbes=module.register_tbes,
+                row_alignment=module.row_alignment,
+            )
+            setattr(root_module, name, qec_cpu)
+        else:
+            worklist.extend(
+                (submodule, module, child_name)
+                for child_name, submodule in module.named_children()
+            )